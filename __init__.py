@@ -1,7 +1,7 @@
 import os
 from .nodes import NODE_CLASS_MAPPINGS as FFMPEG_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as FFMPEG_DISPLAY_MAPPINGS
 from .node_logger import log_node_info, log_node_success, log_node_error, log_node_warning, log_node_debug
-from .ffmpeg_path_resolver import initialize_ffmpeg_path_and_log
+from .ffmpeg_path_resolver import start_ffmpeg_warmup
 
 NODE_CLASS_MAPPINGS = {
     **FFMPEG_MAPPINGS,
@@ -22,6 +22,7 @@ __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
 PACKAGE_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
 INIT_LOG_PREFIX = "AIMMS_Init" 
 
-initialize_ffmpeg_path_and_log(PACKAGE_DIRECTORY)
+# Resolve ffmpeg off the import path; the first save waits for it only if it hasn't finished.
+start_ffmpeg_warmup(PACKAGE_DIRECTORY)
 
 log_node_info(INIT_LOG_PREFIX, "*** Custom Nodes from ComfyUI-AIMMS Initialized ***")
@@ -0,0 +1,321 @@
+# benchmarks/benchmark_save_video.py
+"""Offline benchmark for SaveFramesToVideoFFmpeg.save_video.
+
+Encodes synthetic (B, H, W, C) batches across a matrix of resolutions, frame counts, codecs, pixel formats and
+frame transports with the local ffmpeg, and reports per-stage timings, frames per second and peak RSS of the
+Python process. Each case runs in a fresh interpreter so peak RSS is per case. ComfyUI is not needed:
+`folder_paths` is replaced by a stub writing into a scratch directory when it can't be imported.
+
+    python benchmarks/benchmark_save_video.py --resolutions 512x512,1280x720 --frames 16,64 --codecs libx264
+    python benchmarks/benchmark_save_video.py --output new.json --compare old.json --tolerance 0.10
+    python benchmarks/benchmark_save_video.py --transports png_sequence --sequence-formats png,png_uncompressed,bmp,ppm
+
+Stages (seconds, summed across threads for segmented encodes):
+    tensor_conversion    float -> uint8 quantization of the batch
+    frame_serialization  intermediate image writing (png_sequence transport only, see --sequence-formats)
+    metadata_png         first-frame metadata PNG
+    ffmpeg_encode        ffmpeg runs fed with frames, excluding the conversion that happened while feeding them
+    mux                  stream-copy/audio remux passes (segmented encodes)
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "aimms_save_images_as_video"
+
+DEFAULT_RESOLUTIONS = "512x512,1280x720"
+DEFAULT_FRAMES = "16,64"
+DEFAULT_CODECS = "libx264,libvpx-vp9"
+DEFAULT_PIXEL_FORMATS = "yuv420p"
+DEFAULT_TRANSPORTS = "rawvideo_pipe,png_sequence"
+DEFAULT_SEQUENCE_FORMATS = "png"
+CODEC_CONTAINERS = {"libx264": "mp4", "libx265": "mp4", "libvpx-vp9": "webm", "libsvtav1": "mkv"}
+STAGES = ["tensor_conversion", "frame_serialization", "metadata_png", "ffmpeg_encode", "mux"]
+
+
+def install_folder_paths_stub(output_dir):
+    """Provides the slice of ComfyUI's folder_paths the node uses, rooted at output_dir."""
+    stub = types.ModuleType("folder_paths")
+    stub.get_output_directory = lambda: output_dir
+    sys.modules["folder_paths"] = stub
+
+
+def load_node_module(output_dir):
+    """Imports the package from PACKAGE_DIR (its directory name isn't importable) and returns its nodes module."""
+    try:
+        import folder_paths  # noqa: F401  (real ComfyUI install)
+    except ImportError:
+        install_folder_paths_stub(output_dir)
+    spec = importlib.util.spec_from_file_location(PACKAGE_NAME, os.path.join(PACKAGE_DIR, "__init__.py"),
+                                                  submodule_search_locations=[PACKAGE_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+    return sys.modules[f"{PACKAGE_NAME}.nodes"]
+
+
+def make_timed_node_class(node_class):
+    """Subclass of the node that accumulates wall time per stage around its pipeline hooks."""
+
+    class TimedNode(node_class):
+        def __init__(self):
+            super().__init__()
+            self.stage_seconds = defaultdict(float)
+            self._stage_lock = threading.Lock()
+            self._local = threading.local()
+
+        def _add(self, stage, seconds):
+            with self._stage_lock:
+                self.stage_seconds[stage] += seconds
+
+        def _conversion_so_far(self):
+            return getattr(self._local, "conversion", 0.0)
+
+        def iter_frame_chunks(self, images, *args, **kwargs):
+            chunks = iter(super().iter_frame_chunks(images, *args, **kwargs))
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                elapsed = time.perf_counter() - started
+                self._local.conversion = self._conversion_so_far() + elapsed
+                self._add("tensor_conversion", elapsed)
+                if chunk is None:
+                    return
+                yield chunk
+
+        def write_png_sequence(self, images, temp_dir, *args, **kwargs):
+            started, conversion_before = time.perf_counter(), self._conversion_so_far()
+            try:
+                return super().write_png_sequence(images, temp_dir, *args, **kwargs)
+            finally:
+                conversion = self._conversion_so_far() - conversion_before
+                self._add("frame_serialization", time.perf_counter() - started - conversion)
+
+        def save_metadata_to_png(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().save_metadata_to_png(*args, **kwargs)
+            finally:
+                self._add("metadata_png", time.perf_counter() - started)
+
+        def remux_target(self, *args, **kwargs):
+            self._local.in_mux = True
+            try:
+                return super().remux_target(*args, **kwargs)
+            finally:
+                self._local.in_mux = False
+
+        def execute_ffmpeg(self, *args, **kwargs):
+            started, conversion_before = time.perf_counter(), self._conversion_so_far()
+            try:
+                return super().execute_ffmpeg(*args, **kwargs)
+            finally:
+                conversion = self._conversion_so_far() - conversion_before
+                stage = "mux" if getattr(self._local, "in_mux", False) else "ffmpeg_encode"
+                self._add(stage, time.perf_counter() - started - conversion)
+
+    return TimedNode
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(case, output_dir):
+    """Runs one benchmark case in this process and returns its result dict."""
+    import torch
+
+    nodes = load_node_module(output_dir)
+    node = make_timed_node_class(nodes.SaveFramesToVideoFFmpeg)()
+    generator = torch.Generator().manual_seed(0)
+    images = torch.rand(case["frames"], case["height"], case["width"], 3, generator=generator)
+    audio = None
+    if case["audio"]:
+        samples = int(case["frames"] / case["fps"] * 44100)
+        audio = {"waveform": torch.rand(1, 2, samples, generator=generator) * 0.2 - 0.1, "sample_rate": 44100}
+
+    started = time.perf_counter()
+    result = node.save_video(
+        images, "bench", case["id"], case["fps"], case["codec"], case["pixel_format"], case["output_format"],
+        save_metadata="enabled", overwrite_existing=True, show_preview=True, ffmpeg_verbose="quiet", audio=audio,
+        frame_transport=case["frame_transport"], sequence_format=case["sequence_format"],
+        sequence_workers=case["sequence_workers"], segments=case["segments"],
+        performance_profile=case["performance_profile"], prefer_hardware_encoder=case["prefer_hardware_encoder"])
+    wall = time.perf_counter() - started
+
+    outputs = [os.path.join(output_dir, case["id"], entry["filename"]) for entry in result["ui"].get("images", [])]
+    video_paths = [path for path in outputs if not path.endswith(".png")]
+    ok = bool(video_paths) and all(os.path.getsize(path) > 0 for path in video_paths)
+    return {
+        **case,
+        "ok": ok,
+        "error": None if ok else " ".join(result["ui"].get("text", [])) or "no output",
+        "wall_seconds": round(wall, 4),
+        "fps_encoded": round(case["frames"] / wall, 2) if wall > 0 else None,
+        "stages": {stage: round(node.stage_seconds.get(stage, 0.0), 4) for stage in STAGES},
+        "output_bytes": sum(os.path.getsize(path) for path in video_paths) if ok else 0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def build_cases(args):
+    cases = []
+    for resolution in args.resolutions.split(","):
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        for frames in (int(v) for v in args.frames.split(",")):
+            for codec in args.codecs.split(","):
+                for pixel_format in args.pixel_formats.split(","):
+                    for frame_transport in args.transports.split(","):
+                        # Intermediate formats only matter for png_sequence; the raw pipe runs once.
+                        sequence_formats = args.sequence_formats.split(",") if frame_transport == "png_sequence" else ["png"]
+                        for sequence_format in sequence_formats:
+                            case_id = f"{width}x{height}_{frames}f_{codec}_{pixel_format}_{frame_transport}"
+                            if sequence_format != "png":
+                                case_id += f"_{sequence_format}"
+                            if args.segments > 1:
+                                case_id += f"_seg{args.segments}"
+                            cases.append({
+                                "id": case_id, "width": width, "height": height, "frames": frames, "fps": args.fps,
+                                "codec": codec, "pixel_format": pixel_format, "output_format": CODEC_CONTAINERS.get(codec, "mkv"),
+                                "frame_transport": frame_transport, "sequence_format": sequence_format,
+                                "sequence_workers": args.sequence_workers, "segments": args.segments, "audio": args.audio,
+                                "performance_profile": args.profile, "prefer_hardware_encoder": args.hardware,
+                            })
+    return cases
+
+
+def run_case_subprocess(case, output_dir, verbose):
+    """Runs a case in a fresh interpreter (isolated peak RSS) and returns its result dict."""
+    with tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as result_file:
+        result_path = result_file.name
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case),
+               "--case-output-dir", output_dir, "--case-result", result_path]
+        sink = None if verbose else subprocess.DEVNULL
+        completed = subprocess.run(cmd, stdout=sink, stderr=sink)
+        if completed.returncode != 0 or os.path.getsize(result_path) == 0:
+            return {**case, "ok": False, "error": f"benchmark process exited with code {completed.returncode}"}
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def environment_info():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()}
+    try:
+        import torch
+        info["torch"] = torch.__version__
+    except ImportError:
+        pass
+    try:
+        with open(os.path.join(PACKAGE_DIR, "pyproject.toml"), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("version"):
+                    info["package_version"] = line.split("=", 1)[1].strip().strip('"')
+                    break
+    except OSError:
+        pass
+    return info
+
+
+def compare_results(results, baseline_path, tolerance):
+    """Prints fps changes against a previous results file. Returns the ids of cases that regressed."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {entry["id"]: entry for entry in json.load(f)["results"]}
+    regressions = []
+    for entry in results:
+        previous = baseline.get(entry["id"])
+        if not previous or not previous.get("ok") or not entry.get("ok"):
+            continue
+        change = entry["fps_encoded"] / previous["fps_encoded"] - 1.0
+        marker = ""
+        if change < -tolerance:
+            marker = "  REGRESSION"
+            regressions.append(entry["id"])
+        print(f"{entry['id']:<60} {previous['fps_encoded']:>9.1f} -> {entry['fps_encoded']:>9.1f} fps ({change:+.1%}){marker}")
+    return regressions
+
+
+def print_result(entry):
+    if not entry.get("ok"):
+        print(f"{entry['id']:<60} FAILED: {entry.get('error')}")
+        return
+    stages = " ".join(f"{stage}={entry['stages'][stage]:.3f}" for stage in STAGES if entry["stages"][stage])
+    print(f"{entry['id']:<60} {entry['wall_seconds']:>7.3f}s {entry['fps_encoded']:>9.1f} fps "
+          f"rss={entry['peak_rss_mb']}MiB  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="Comma-separated WIDTHxHEIGHT list.")
+    parser.add_argument("--frames", default=DEFAULT_FRAMES, help="Comma-separated frame counts.")
+    parser.add_argument("--codecs", default=DEFAULT_CODECS, help="Comma-separated codec choices of the node.")
+    parser.add_argument("--pixel-formats", default=DEFAULT_PIXEL_FORMATS, help="Comma-separated pixel formats.")
+    parser.add_argument("--transports", default=DEFAULT_TRANSPORTS, help="Comma-separated frame_transport values.")
+    parser.add_argument("--sequence-formats", default=DEFAULT_SEQUENCE_FORMATS,
+                        help="Comma-separated sequence_format values for the png_sequence transport.")
+    parser.add_argument("--sequence-workers", type=int, default=0, help="sequence_workers passed to the node (0 = CPU count).")
+    parser.add_argument("--fps", type=float, default=24.0)
+    parser.add_argument("--segments", type=int, default=1)
+    parser.add_argument("--profile", default="balanced", help="performance_profile passed to the node.")
+    parser.add_argument("--hardware", action="store_true", help="Allow hardware encoders (off by default for comparable runs).")
+    parser.add_argument("--audio", action="store_true", help="Mux a synthetic stereo track.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the fastest is kept.")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--compare", help="Previous results JSON to compare fps against.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed fps drop before --compare reports a regression.")
+    parser.add_argument("--verbose", action="store_true", help="Show the node's log output.")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--case-output-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--case-result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        entry = run_case(json.loads(args.run_case), args.case_output_dir)
+        with open(args.case_result, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        return 0
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="aimms_bench_") as output_dir:
+        for case in build_cases(args):
+            runs = [run_case_subprocess(case, output_dir, args.verbose) for _ in range(max(1, args.repeat))]
+            passed = [run for run in runs if run.get("ok")]
+            entry = min(passed, key=lambda run: run["wall_seconds"]) if passed else runs[-1]
+            print_result(entry)
+            results.append(entry)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment_info(), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.tolerance:.0%}.")
+            return 1
+    return 0 if all(entry.get("ok") for entry in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
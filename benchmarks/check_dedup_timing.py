@@ -0,0 +1,97 @@
+# benchmarks/check_dedup_timing.py
+"""CPU-only check that deduplicate_frames keeps the timing of SaveFramesToVideoFFmpeg's outputs.
+
+Saves two 48-frame clips at 24 fps, once with deduplicate_frames and once without, as mp4, mkv and webm:
+
+    tail: frames 10-47 are identical, so the clip ends on a held run;
+    mid:  frames 10-30 are identical.
+
+For every clip and container, the deduplicated video must report the same container duration and decode to the
+same number of frames at the clip's fps (a constant-frame-rate decode) as the plain one.
+
+    python benchmarks/check_dedup_timing.py
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from benchmark_save_video import load_node_module
+
+FPS = 24.0
+FRAMES = 48
+CLIPS = {
+    "tail": [min(index, 10) for index in range(FRAMES)],
+    "mid": [10 if 10 <= index <= 30 else index for index in range(FRAMES)],
+}
+CONTAINERS = {"mp4": "libx264", "mkv": "libx264", "webm": "libvpx-vp9"}
+
+
+def container_duration(ffmpeg_path, video_path):
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-i', video_path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):([\d.]+)", result.stderr)
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3)) if match else None
+
+
+def cfr_frames(ffmpeg_path, video_path, fps):
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-i', video_path, '-vf', f"fps={fps}", '-f', 'null', '-'],
+                            capture_output=True, text=True)
+    counts = re.findall(r"frame=\s*(\d+)", result.stderr)
+    return int(counts[-1]) if result.returncode == 0 and counts else 0
+
+
+def main():
+    import torch
+
+    failures = []
+
+    def check(condition, description):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    with tempfile.TemporaryDirectory(prefix="aimms_dedup_") as output_dir:
+        nodes = load_node_module(output_dir)
+
+        class RecordingNode(nodes.SaveFramesToVideoFFmpeg):
+            def __init__(self):
+                super().__init__()
+                self.filters = []
+
+            def execute_ffmpeg(self, ffmpeg_cmd, *args, **kwargs):
+                self.filters.append(ffmpeg_cmd[ffmpeg_cmd.index('-vf') + 1] if '-vf' in ffmpeg_cmd else None)
+                return super().execute_ffmpeg(ffmpeg_cmd, *args, **kwargs)
+
+        palette = torch.rand(FRAMES, 64, 96, 3, generator=torch.Generator().manual_seed(0))
+        for clip, sources in CLIPS.items():
+            images = palette[sources]
+            for output_format, codec in CONTAINERS.items():
+                measured = {}
+                for deduplicate in (False, True):
+                    node = RecordingNode()
+                    prefix = f"{clip}_{'dedup' if deduplicate else 'plain'}"
+                    result = node.save_video(images, prefix, "check", FPS, codec, "yuv420p", output_format, save_metadata="disabled",
+                                             ffmpeg_verbose="quiet", deduplicate_frames=deduplicate)
+                    video_path = os.path.join(output_dir, "check", f"{prefix}.{output_format}")
+                    if "images" not in result["ui"] or not os.path.isfile(video_path):
+                        check(False, f"{clip} {output_format}: {prefix} saved ({result['ui']})")
+                        break
+                    if deduplicate:
+                        check(bool(node.filters and node.filters[0]), f"{clip} {output_format}: held frames were collapsed")
+                    measured[deduplicate] = (container_duration(node.ffmpeg_executable_path, video_path),
+                                             cfr_frames(node.ffmpeg_executable_path, video_path, FPS))
+                if len(measured) < 2:
+                    continue
+                (plain_duration, plain_frames), (dedup_duration, dedup_frames) = measured[False], measured[True]
+                check(plain_duration is not None and dedup_duration == plain_duration,
+                      f"{clip} {output_format}: duration {dedup_duration} s matches {plain_duration} s")
+                check(dedup_frames == plain_frames == FRAMES,
+                      f"{clip} {output_format}: {dedup_frames} frames at {FPS:g} fps (plain {plain_frames}, expected {FRAMES})")
+
+    print(f"{len(failures)} check(s) failed." if failures else "All checks passed.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
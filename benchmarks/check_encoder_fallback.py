@@ -0,0 +1,91 @@
+# benchmarks/check_encoder_fallback.py
+"""CPU-only check of the hardware encoder fallback in SaveFramesToVideoFFmpeg.save_video.
+
+Reports two hardware encoders for libx264 that the local ffmpeg can't run, then saves a short clip with
+prefer_hardware_encoder and checks that:
+
+    1. both unusable encoders are tried, in order, before libx264 writes a complete video;
+    2. both are remembered as failed, so the next save goes straight to libx264;
+    3. prefer_hardware_encoder is off by default.
+
+No GPU or ComfyUI is needed (see benchmark_save_video.py for the folder_paths stub).
+
+    python benchmarks/check_encoder_fallback.py
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from benchmark_save_video import PACKAGE_NAME, load_node_module
+
+UNUSABLE_ENCODERS = ["h264_unusable_first", "h264_unusable_second"]
+FRAMES = 8
+
+
+def install_unusable_encoders(profiles):
+    """Makes encoder_profiles see UNUSABLE_ENCODERS as libx264's hardware candidates, without touching the
+    capability cache on disk."""
+    real_capabilities, real_pixel_formats = profiles.get_ffmpeg_capabilities, profiles.get_encoder_pixel_formats
+
+    def capabilities():
+        probed = real_capabilities() or {"encoders": set()}
+        return {**probed, "encoders": set(probed["encoders"]) | set(UNUSABLE_ENCODERS)}
+
+    profiles.get_ffmpeg_capabilities = capabilities
+    profiles.get_encoder_pixel_formats = lambda encoder: None if encoder in UNUSABLE_ENCODERS else real_pixel_formats(encoder)
+    profiles.HARDWARE_ENCODERS["libx264"] = list(UNUSABLE_ENCODERS)
+
+
+def decoded_frames(ffmpeg_path, video_path):
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-i', video_path, '-f', 'null', '-'], capture_output=True, text=True)
+    counts = re.findall(r"frame=\s*(\d+)", result.stderr)
+    return int(counts[-1]) if result.returncode == 0 and counts else 0
+
+
+def main():
+    import torch
+
+    failures = []
+
+    def check(condition, description):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    with tempfile.TemporaryDirectory(prefix="aimms_fallback_") as output_dir:
+        nodes = load_node_module(output_dir)
+        profiles = sys.modules[f"{PACKAGE_NAME}.encoder_profiles"]
+        install_unusable_encoders(profiles)
+
+        class RecordingNode(nodes.SaveFramesToVideoFFmpeg):
+            def __init__(self):
+                super().__init__()
+                self.encoders_run = []
+
+            def execute_ffmpeg(self, ffmpeg_cmd, *args, **kwargs):
+                self.encoders_run.append(ffmpeg_cmd[ffmpeg_cmd.index('-c:v') + 1])
+                return super().execute_ffmpeg(ffmpeg_cmd, *args, **kwargs)
+
+        images = torch.rand(FRAMES, 64, 96, 3, generator=torch.Generator().manual_seed(0))
+        for attempt, expected_encoders in ((1, UNUSABLE_ENCODERS + ["libx264"]), (2, ["libx264"])):
+            node = RecordingNode()
+            result = node.save_video(images, f"fallback_{attempt}", "check", 24.0, "libx264", "yuv420p", "mp4",
+                                     save_metadata="disabled", ffmpeg_verbose="quiet", prefer_hardware_encoder=True)
+            video_path = os.path.join(output_dir, "check", f"fallback_{attempt}.mp4")
+            check(node.encoders_run == expected_encoders, f"save {attempt} runs {', '.join(expected_encoders)} (ran {node.encoders_run})")
+            check("images" in result["ui"] and os.path.isfile(video_path) and decoded_frames(node.ffmpeg_executable_path, video_path) == FRAMES,
+                  f"save {attempt} writes all {FRAMES} frames with libx264")
+            if attempt == 1:
+                check(not profiles.find_hardware_encoders("libx264", "yuv420p"), "failed hardware encoders are skipped afterwards")
+
+        optional_inputs = nodes.SaveFramesToVideoFFmpeg.INPUT_TYPES()["optional"]
+        check(optional_inputs["prefer_hardware_encoder"][1]["default"] is False, "prefer_hardware_encoder is off by default")
+
+    print(f"{len(failures)} check(s) failed." if failures else "All checks passed.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+# encode_cache.py
+import configparser
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+import torch
+from .node_logger import log_node_debug, log_node_warning
+
+try:
+    import xxhash
+except ImportError:  # Optional speed-up; blake2b is slower on long clips but always available.
+    xxhash = None
+
+CACHE_LOG_PREFIX = "EncodeCache"
+
+_PACKAGE_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_CACHE_DIRECTORY = os.path.join(_PACKAGE_DIRECTORY, "encode_cache")
+DEFAULT_MAX_SIZE_GB = 10.0
+HASH_CHUNK_FRAMES = 16  # Default frames copied to the host per hash update, so CUDA batches are never copied whole.
+ACCESS_RECORD_NAME = "access_times.json"  # Entry name -> last use, kept beside the entries.
+
+_ENCODE_CACHE = None
+_ENCODE_CACHE_LOCK = threading.Lock()
+
+
+def _new_hasher():
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+
+
+def _hash_tensor(hasher, tensor, chunk_size=HASH_CHUNK_FRAMES):
+    """Feeds dtype, shape and raw bytes of a tensor (or NumPy array, e.g. a memmapped frame store) to `hasher`,
+    `chunk_size` slices of dim 0 at a time. Only one slice is ever copied, even for a non-contiguous tensor."""
+    hasher.update(f"{tensor.dtype}{tuple(tensor.shape)}".encode())
+    chunk_size = max(1, int(chunk_size))
+    if isinstance(tensor, np.ndarray):
+        for start in range(0, tensor.shape[0], chunk_size):
+            hasher.update(np.ascontiguousarray(tensor[start:start + chunk_size]))
+        return
+    tensor = tensor.detach()
+    if tensor.ndim == 0:
+        tensor = tensor.reshape(1)
+    for start in range(0, tensor.shape[0], chunk_size):
+        chunk = tensor[start:start + chunk_size].cpu().contiguous()
+        hasher.update(chunk.reshape(-1).view(torch.uint8).numpy())
+
+
+def batch_digest(images, audio=None, chunk_size=HASH_CHUNK_FRAMES):
+    """Content hash of a frame batch and its optional {'waveform', 'sample_rate'} audio, as a hex string. Frames are
+    hashed `chunk_size` at a time; the digest doesn't depend on it."""
+    hasher = _new_hasher()
+    _hash_tensor(hasher, images, chunk_size)
+    if isinstance(audio, dict) and isinstance(audio.get("waveform"), torch.Tensor):
+        _hash_tensor(hasher, audio["waveform"])
+        hasher.update(str(audio.get("sample_rate")).encode())
+    return hasher.hexdigest()
+
+
+def encode_cache_key(digest, params):
+    """Cache key of one encoded output: the batch digest plus every setting that changes the encoded bytes."""
+    return hashlib.sha256(json.dumps([digest, params], sort_keys=True).encode()).hexdigest()[:40]
+
+
+def _place_file(source, destination):
+    """Hardlinks `source` at `destination` (copies across filesystems), atomically replacing whatever is there."""
+    temp_path = f"{destination}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def unshare_file(path):
+    """Unlinks `path` if it has other hardlinks (e.g. an encode cache entry), so writing it in place can't change them."""
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class EncodeCache:
+    """Encoded outputs on local disk, named by content key and evicted least-recently-used past `max_bytes`.
+
+    Entries are hardlinked in and out (copied across filesystems), so a hit costs no encode and, on the same
+    volume, no extra space. An entry shares its inode with the outputs linked from it, so recency is kept in an
+    access record file (ACCESS_RECORD_NAME) rather than in the entry's mtime; entries the record doesn't know
+    fall back to their mtime. The record is rewritten on each hit and store, so the order survives restarts.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._access_record_path = os.path.join(directory, ACCESS_RECORD_NAME)
+        self._access_times = self._load_access_times()
+
+    def _entry_path(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def _load_access_times(self):
+        try:
+            with open(self._access_record_path, "r", encoding="utf-8") as record_file:
+                access_times = json.load(record_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(access_times, dict):
+            return {}
+        return {name: float(used) for name, used in access_times.items() if isinstance(used, (int, float))}
+
+    def _touch(self, entry):
+        """Records `entry` as just used and writes the access record (atomically, so a crash can't truncate it)."""
+        self._access_times[os.path.basename(entry)] = time.time()
+        self._save_access_times()
+
+    def _save_access_times(self):
+        temp_path = f"{self._access_record_path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as record_file:
+                json.dump(self._access_times, record_file)
+            os.replace(temp_path, self._access_record_path)
+        except OSError as e_record:
+            log_node_debug(CACHE_LOG_PREFIX, f"Could not write {self._access_record_path}: {e_record}")
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+
+    def contains(self, key, extension):
+        entry = self._entry_path(key, extension)
+        return os.path.isfile(entry) and os.path.getsize(entry) > 0
+
+    def fetch(self, key, extension, destination):
+        """Places the cached output at `destination`. Returns False on a miss or when it can't be placed."""
+        entry = self._entry_path(key, extension)
+        with self._lock:
+            if not self.contains(key, extension):
+                return False
+            try:
+                _place_file(entry, destination)
+                self._touch(entry)
+                return True
+            except OSError as e_fetch:
+                log_node_warning(CACHE_LOG_PREFIX, f"Could not restore {entry}: {e_fetch}")
+                return False
+
+    def store(self, key, extension, source):
+        """Adds a finished output under `key`, then evicts the least recently used entries past max_bytes."""
+        with self._lock:
+            entry = self._entry_path(key, extension)
+            try:
+                _place_file(source, entry)
+            except OSError as e_store:
+                log_node_warning(CACHE_LOG_PREFIX, f"Could not cache {source}: {e_store}")
+                return
+            self._access_times[os.path.basename(entry)] = time.time()
+            self._evict()
+            self._save_access_times()
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.is_file() and entry.name != ACCESS_RECORD_NAME and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((self._access_times.get(entry.name, stat.st_mtime), stat.st_size, entry.path))
+        # Forget entries removed behind the cache's back, so the record doesn't grow forever.
+        present = {os.path.basename(path) for _, _, path in entries}
+        self._access_times = {name: used for name, used in self._access_times.items() if name in present}
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._access_times.pop(os.path.basename(path), None)
+                total_bytes -= size
+                log_node_debug(CACHE_LOG_PREFIX, f"Evicted {os.path.basename(path)} ({size} bytes).")
+            except OSError:
+                pass
+
+
+def _read_cache_settings():
+    """(directory, max_bytes) from the [ENCODE_CACHE] section of ffmpeg_config.ini, with defaults."""
+    directory, max_size_gb = DEFAULT_CACHE_DIRECTORY, DEFAULT_MAX_SIZE_GB
+    config_file_path = os.path.join(_PACKAGE_DIRECTORY, "ffmpeg_config.ini")
+    if os.path.exists(config_file_path):
+        try:
+            config = configparser.ConfigParser(); config.read(config_file_path)
+            section = config['ENCODE_CACHE'] if 'ENCODE_CACHE' in config else {}
+            configured_directory = section.get('cache_dir', '').strip()
+            if configured_directory:
+                directory = os.path.abspath(os.path.join(_PACKAGE_DIRECTORY, configured_directory))
+            if section.get('max_size_gb', '').strip():
+                max_size_gb = float(section['max_size_gb'])
+        except (configparser.Error, ValueError) as e_cfg:
+            log_node_warning(CACHE_LOG_PREFIX, f"Error reading [ENCODE_CACHE] from ffmpeg_config.ini: {e_cfg}. Using defaults.")
+    return directory, int(max_size_gb * 1024 ** 3)
+
+
+def get_encode_cache():
+    """Returns the process-wide EncodeCache, created from ffmpeg_config.ini on first use."""
+    global _ENCODE_CACHE
+    with _ENCODE_CACHE_LOCK:
+        if _ENCODE_CACHE is None:
+            _ENCODE_CACHE = EncodeCache(*_read_cache_settings())
+        return _ENCODE_CACHE
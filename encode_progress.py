@@ -0,0 +1,35 @@
+# encode_progress.py
+import threading
+
+try:
+    from comfy.utils import ProgressBar
+except ImportError:  # Outside ComfyUI (e.g. the benchmark): progress is still tracked, just not displayed.
+    ProgressBar = None
+
+
+class EncodeProgress:
+    """Drives a ComfyUI progress bar from the `-progress` frame counts of one or more concurrent ffmpeg runs."""
+
+    def __init__(self, total_frames):
+        self.total_frames = total_frames
+        self._bar = ProgressBar(total_frames) if ProgressBar is not None and total_frames > 0 else None
+        self._frames_by_run = {}
+        self._lock = threading.Lock()
+
+    def set_total(self, total_frames):
+        """Changes the frame count the bar fills up to (e.g. when held frames are not sent to ffmpeg)."""
+        self.total_frames = total_frames
+
+    def callback(self, run_key):
+        """Returns a progress_callback for one ffmpeg run. A retried run reuses its key and starts over."""
+        def update(progress):
+            try:
+                frame = int(progress.get("frame", 0))
+            except ValueError:
+                return
+            with self._lock:
+                self._frames_by_run[run_key] = frame
+                done = min(self.total_frames, sum(self._frames_by_run.values()))
+            if self._bar is not None:
+                self._bar.update_absolute(done, self.total_frames)
+        return update
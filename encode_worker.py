@@ -0,0 +1,82 @@
+# encode_worker.py
+import atexit
+import itertools
+import queue
+import threading
+import time
+from .node_logger import log_node_info, log_node_success, log_node_error, log_node_warning
+
+WORKER_LOG_PREFIX = "BackgroundEncoder"
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUED = 4  # Jobs waiting beyond the running ones; submit() blocks past this to cap held frame memory.
+
+_BACKGROUND_ENCODER = None
+_BACKGROUND_ENCODER_LOCK = threading.Lock()
+
+
+class BackgroundEncoder:
+    """Bounded pool of daemon threads that run encode jobs off the ComfyUI executor thread.
+
+    A job is a callable returning (success, message). Results and timings are reported through the node logger.
+    """
+
+    def __init__(self, num_workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED):
+        self._jobs = queue.Queue(maxsize=max(1, max_queued))
+        self._job_ids = itertools.count(1)
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._workers = []
+        for index in range(max(1, num_workers)):
+            worker = threading.Thread(target=self._worker_loop, name=f"aimms-encode-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, label, job):
+        """Queues `job` and returns its id. Blocks while the queue is full (backpressure on the executor)."""
+        job_id = next(self._job_ids)
+        with self._idle:
+            self._pending += 1
+        entry = (job_id, label, job, time.perf_counter())
+        try:
+            self._jobs.put_nowait(entry)
+        except queue.Full:
+            log_node_warning(WORKER_LOG_PREFIX, f"Encode queue full ({self._jobs.maxsize}); waiting for a free slot for job #{job_id}.")
+            self._jobs.put(entry)
+        log_node_info(WORKER_LOG_PREFIX, f"Job #{job_id} queued: {label}")
+        return job_id
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every submitted job has finished. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def _worker_loop(self):
+        while True:
+            job_id, label, job, queued_at = self._jobs.get()
+            started_at = time.perf_counter()
+            try:
+                success, message = job()
+            except Exception as e:
+                success, message = False, f"Python error: {e}"
+            finished_at = time.perf_counter()
+            timing = f"waited {started_at - queued_at:.2f}s, encoded in {finished_at - started_at:.2f}s"
+            if success:
+                log_node_success(WORKER_LOG_PREFIX, f"Job #{job_id} done ({timing}): {label}")
+            else:
+                log_node_error(WORKER_LOG_PREFIX, f"Job #{job_id} failed ({timing}): {label}\n{message}")
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+            self._jobs.task_done()
+
+
+def get_background_encoder():
+    """Returns the process-wide BackgroundEncoder, starting it on first use."""
+    global _BACKGROUND_ENCODER
+    with _BACKGROUND_ENCODER_LOCK:
+        if _BACKGROUND_ENCODER is None:
+            _BACKGROUND_ENCODER = BackgroundEncoder()
+            # Let queued encodes finish on a clean interpreter shutdown instead of dying with the daemon threads.
+            atexit.register(_BACKGROUND_ENCODER.wait_idle)
+        return _BACKGROUND_ENCODER
@@ -0,0 +1,101 @@
+# encoder_profiles.py
+import threading
+from .ffmpeg_path_resolver import get_ffmpeg_capabilities, get_encoder_pixel_formats
+
+PERFORMANCE_PROFILES = ["balanced", "fastest", "smallest"]
+
+# Encoder -> profile -> quality/speed options. "balanced" keeps the node's historical settings for the
+# software encoders (crf 19 for x264/x265, crf 35 for svt-av1, encoder default presets).
+ENCODER_PROFILE_ARGS = {
+    "libx264": {
+        "fastest": ['-preset', 'veryfast', '-crf', '19'],
+        "balanced": ['-crf', '19'],
+        "smallest": ['-preset', 'slow', '-crf', '23'],
+    },
+    "libx265": {
+        "fastest": ['-preset', 'veryfast', '-crf', '19'],
+        "balanced": ['-crf', '19'],
+        "smallest": ['-preset', 'slow', '-crf', '24'],
+    },
+    "libvpx-vp9": {
+        "fastest": ['-row-mt', '1', '-deadline', 'realtime', '-cpu-used', '8'],
+        "balanced": ['-row-mt', '1'],
+        "smallest": ['-row-mt', '1', '-deadline', 'good', '-cpu-used', '1', '-crf', '36', '-b:v', '0'],
+    },
+    "libsvtav1": {
+        "fastest": ['-preset', '10', '-crf', '35'],
+        "balanced": ['-crf', '35'],
+        "smallest": ['-preset', '4', '-crf', '38'],
+    },
+    "libaom-av1": {
+        "fastest": ['-cpu-used', '8', '-row-mt', '1', '-crf', '35'],
+        "balanced": ['-cpu-used', '6', '-row-mt', '1', '-crf', '35'],
+        "smallest": ['-cpu-used', '4', '-row-mt', '1', '-crf', '38'],
+    },
+    "librav1e": {
+        "fastest": ['-speed', '10'],
+        "balanced": [],
+        "smallest": ['-speed', '4'],
+    },
+}
+
+# Hardware encoders by vendor API. Same option shapes across codecs, so they are generated below.
+_HARDWARE_FAMILY_ARGS = {
+    "nvenc": {"fastest": ['-preset', 'p1', '-rc', 'vbr', '-cq', '23'], "balanced": ['-preset', 'p4', '-rc', 'vbr', '-cq', '21'],
+              "smallest": ['-preset', 'p7', '-rc', 'vbr', '-cq', '26']},
+    "qsv": {"fastest": ['-preset', 'veryfast', '-global_quality', '23'], "balanced": ['-preset', 'medium', '-global_quality', '21'],
+            "smallest": ['-preset', 'veryslow', '-global_quality', '26']},
+    "amf": {"fastest": ['-quality', 'speed', '-rc', 'cqp', '-qp_i', '23', '-qp_p', '23'],
+            "balanced": ['-quality', 'balanced', '-rc', 'cqp', '-qp_i', '21', '-qp_p', '21'],
+            "smallest": ['-quality', 'quality', '-rc', 'cqp', '-qp_i', '26', '-qp_p', '26']},
+    "videotoolbox": {"fastest": ['-realtime', '1', '-q:v', '60'], "balanced": ['-q:v', '65'], "smallest": ['-q:v', '50']},
+}
+
+# Software codec choice -> hardware encoders of the same codec, in preference order.
+HARDWARE_ENCODERS = {
+    "libx264": ["h264_nvenc", "h264_qsv", "h264_amf", "h264_videotoolbox"],
+    "libx265": ["hevc_nvenc", "hevc_qsv", "hevc_amf", "hevc_videotoolbox"],
+    "libsvtav1": ["av1_nvenc", "av1_qsv", "av1_amf"],
+    "libvpx-vp9": [],
+}
+
+# Hardware encoders that failed an encode which a later candidate then completed (typically: compiled in, but no
+# such GPU or driver). Skipped for the rest of the process so every save doesn't pay for the failed attempt again.
+_FAILED_HARDWARE_ENCODERS = set()
+_FAILED_HARDWARE_LOCK = threading.Lock()
+
+for _encoders in HARDWARE_ENCODERS.values():
+    for _encoder in _encoders:
+        ENCODER_PROFILE_ARGS[_encoder] = _HARDWARE_FAMILY_ARGS[_encoder.split("_", 1)[1]]
+
+
+def encoder_profile_args(encoder, profile):
+    """Returns the quality/speed options for `encoder` under a performance profile ([] for unknown encoders)."""
+    profiles = ENCODER_PROFILE_ARGS.get(encoder, {})
+    return list(profiles.get(profile, profiles.get("balanced", [])))
+
+
+def find_hardware_encoders(codec, pixel_format):
+    """Returns the hardware encoders for `codec` that the resolved ffmpeg reports, that accept `pixel_format` and
+    that haven't failed in this process, in preference order. Being compiled in does not guarantee a usable
+    device, so callers must be ready to move on to the next one and finally to software."""
+    capabilities = get_ffmpeg_capabilities()
+    if capabilities is None:
+        return []
+    with _FAILED_HARDWARE_LOCK:
+        failed = set(_FAILED_HARDWARE_ENCODERS)
+    candidates = []
+    for encoder in HARDWARE_ENCODERS.get(codec, []):
+        if encoder not in capabilities["encoders"] or encoder in failed:
+            continue
+        pixel_formats = get_encoder_pixel_formats(encoder)
+        if pixel_formats and pixel_format not in pixel_formats:
+            continue
+        candidates.append(encoder)
+    return candidates
+
+
+def mark_hardware_encoders_failed(encoders):
+    """Excludes `encoders` from find_hardware_encoders for the rest of the process."""
+    with _FAILED_HARDWARE_LOCK:
+        _FAILED_HARDWARE_ENCODERS.update(encoders)
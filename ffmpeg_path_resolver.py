@@ -1,11 +1,21 @@
 # ffmpeg_path_resolver.py
 import os
+import json
+import shutil
 import subprocess
 import configparser
+import threading
 from .node_logger import log_node_info, log_node_success, log_node_warning, log_node_error, log_node_debug
 
 _CACHED_FFMPEG_PATH = None
 _CACHED_FFMPEG_SOURCE_TYPE = None # Source type: "config", "local_bin", "system_path", "fallback"
+_CACHED_CAPABILITIES = None
+_CACHED_FINGERPRINT = None
+_PACKAGE_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+_CAPABILITIES_CACHE_FILE = os.path.join(_PACKAGE_DIRECTORY, "ffmpeg_capabilities_cache.json")
+_PATH_CACHE_FILE = os.path.join(_PACKAGE_DIRECTORY, "ffmpeg_path_cache.json")
+# Held while resolving, so a save that starts during the warm-up waits for it instead of probing twice.
+_RESOLVE_LOCK = threading.RLock()
 
 # Use a fixed prefix for the logs of this module.
 RESOLVER_LOG_PREFIX = "FFmpegPathResolver" 
@@ -19,16 +29,7 @@ def _test_ffmpeg_executable(path_to_test):
     except Exception:
         return False
 
-def initialize_ffmpeg_path_and_log(package_root_directory):
-    global _CACHED_FFMPEG_PATH, _CACHED_FFMPEG_SOURCE_TYPE
-    if _CACHED_FFMPEG_PATH is not None: # Already initialized
-        return
-
-    ffmpeg_command_name = "ffmpeg"
-    determined_path = None
-    source_type = "unknown"
-
-    # 1. Config file
+def _read_configured_ffmpeg_path(package_root_directory):
     config_file_path = os.path.join(package_root_directory, "ffmpeg_config.ini")
     path_from_config_ini = None
     if os.path.exists(config_file_path):
@@ -39,7 +40,16 @@ def initialize_ffmpeg_path_and_log(package_root_directory):
                 if configured_value: path_from_config_ini = configured_value
         except Exception as e_cfg:
             log_node_warning(RESOLVER_LOG_PREFIX, f"Error reading ffmpeg_config.ini: {e_cfg}.")
+    return path_from_config_ini
+
 
+def _probe_ffmpeg_path(package_root_directory, path_from_config_ini):
+    """Tests the configured path, the local ffmpeg_bin and the system PATH in turn. Returns (path, source_type)."""
+    ffmpeg_command_name = "ffmpeg"
+    determined_path = None
+    source_type = "unknown"
+
+    # 1. Config file
     if path_from_config_ini:
         abs_path = os.path.abspath(os.path.join(package_root_directory, path_from_config_ini) if not os.path.isabs(path_from_config_ini) else path_from_config_ini)
         potential_path = None
@@ -75,16 +85,198 @@ def initialize_ffmpeg_path_and_log(package_root_directory):
             log_node_error(RESOLVER_LOG_PREFIX, f"ffmpeg ('{ffmpeg_command_name}') also not found or not working in system PATH.")
             determined_path = ffmpeg_command_name # Fallback
             source_type = "fallback"
+    return determined_path, source_type
 
-    _CACHED_FFMPEG_PATH = determined_path
-    _CACHED_FFMPEG_SOURCE_TYPE = source_type
+
+def _optional_fingerprint(ffmpeg_path):
+    try:
+        return _binary_fingerprint(ffmpeg_path)
+    except OSError:
+        return None
+
+
+def _resolution_inputs(package_root_directory, path_from_config_ini):
+    """Everything the probe's answer depends on: the configured value and the binaries each lookup step would test.
+    Only stat calls, so checking a cached answer costs no subprocess."""
+    return {"config": path_from_config_ini,
+            "local_bin": _optional_fingerprint(os.path.join(package_root_directory, "ffmpeg_bin", "ffmpeg")),
+            "system_path": _optional_fingerprint("ffmpeg")}
+
+
+def _load_cached_path(inputs):
+    try:
+        with open(_PATH_CACHE_FILE, "r", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if cached.get("inputs") != inputs or cached.get("binary") != _optional_fingerprint(cached.get("path", "")):
+        return None
+    return cached["path"], cached["source_type"]
+
+
+def _store_cached_path(inputs, ffmpeg_path, source_type):
+    try:
+        with open(_PATH_CACHE_FILE, "w", encoding="utf-8") as cache_file:
+            json.dump({"inputs": inputs, "path": ffmpeg_path, "source_type": source_type,
+                       "binary": _optional_fingerprint(ffmpeg_path)}, cache_file)
+    except OSError as e_cache:
+        log_node_debug(RESOLVER_LOG_PREFIX, f"Could not write ffmpeg path cache: {e_cache}")
+
+
+def initialize_ffmpeg_path_and_log(package_root_directory):
+    """Resolves the ffmpeg executable once per process. A result cached in ffmpeg_path_cache.json is reused while the
+    config value and the candidate binaries are unchanged, so restarts skip the `ffmpeg -version` probes."""
+    global _CACHED_FFMPEG_PATH, _CACHED_FFMPEG_SOURCE_TYPE
+    with _RESOLVE_LOCK:
+        if _CACHED_FFMPEG_PATH is not None: # Already initialized
+            return
+        path_from_config_ini = _read_configured_ffmpeg_path(package_root_directory)
+        inputs = _resolution_inputs(package_root_directory, path_from_config_ini)
+        cached = _load_cached_path(inputs)
+        if cached is not None:
+            determined_path, source_type = cached
+            log_node_info(RESOLVER_LOG_PREFIX, f"Using cached ffmpeg path ({source_type}): {determined_path}")
+        else:
+            determined_path, source_type = _probe_ffmpeg_path(package_root_directory, path_from_config_ini)
+            if source_type != "fallback":
+                _store_cached_path(inputs, determined_path, source_type)
+        _CACHED_FFMPEG_SOURCE_TYPE = source_type
+        _CACHED_FFMPEG_PATH = determined_path
+
+
+def start_ffmpeg_warmup(package_root_directory):
+    """Resolves ffmpeg and loads its capabilities on a daemon thread, so neither package import nor the first save
+    waits on the probes. Callers that need the path before it finishes block in get_ffmpeg_path()."""
+    def warm_up():
+        try:
+            initialize_ffmpeg_path_and_log(package_root_directory)
+            get_ffmpeg_capabilities()
+        except Exception as e_warmup:
+            log_node_warning(RESOLVER_LOG_PREFIX, f"ffmpeg warm-up failed ({e_warmup}); will retry on first use.")
+
+    threading.Thread(target=warm_up, name="aimms-ffmpeg-warmup", daemon=True).start()
 
 
 def get_ffmpeg_path():
-    global _CACHED_FFMPEG_PATH
+    """Returns the resolved ffmpeg command, resolving it now if neither the warm-up nor an earlier call has."""
     if _CACHED_FFMPEG_PATH is None:
-        # This situation should not occur if initialize_ffmpeg_path_and_log is called from the package's __init__.py.
-        log_node_error("FFmpegPath", "FATAL: get_ffmpeg_path() called before path was initialized!")
-        # Return the default, but this is a sign of a problem in the initialization process.
-        return "ffmpeg" 
+        initialize_ffmpeg_path_and_log(_PACKAGE_DIRECTORY)
     return _CACHED_FFMPEG_PATH
+
+
+def _parse_ffmpeg_listing(output):
+    """Returns the names from an `ffmpeg -encoders/-pix_fmts/-muxers` listing (rows after the dashed separator)."""
+    names = set()
+    in_table = False
+    for line in output.splitlines():
+        stripped = line.strip()
+        if not in_table:
+            in_table = stripped.startswith("--") and set(stripped) == {"-"}
+            continue
+        fields = stripped.split()
+        if len(fields) >= 2:
+            names.update(name for name in fields[1].split(",") if name)
+    return names
+
+
+def _binary_fingerprint(ffmpeg_path):
+    """(real path, mtime, size) of the ffmpeg binary, or None if it can't be located on disk."""
+    located = shutil.which(ffmpeg_path) or (ffmpeg_path if os.path.isfile(ffmpeg_path) else None)
+    if not located:
+        return None
+    real_path = os.path.realpath(located)
+    stat = os.stat(real_path)
+    return {"binary": real_path, "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def probe_ffmpeg_capabilities(ffmpeg_path):
+    """Runs ffmpeg once per listing and returns {"encoders": set, "pix_fmts": set, "muxers": set}."""
+    capabilities = {}
+    for key, flag in (("encoders", "-encoders"), ("pix_fmts", "-pix_fmts"), ("muxers", "-muxers")):
+        result = subprocess.run([ffmpeg_path, '-hide_banner', flag], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=10, check=True)
+        capabilities[key] = _parse_ffmpeg_listing(result.stdout.decode('utf-8', errors='replace'))
+    capabilities["encoder_pix_fmts"] = {}  # Filled lazily by get_encoder_pixel_formats().
+    return capabilities
+
+
+def _load_cached_capabilities(fingerprint):
+    try:
+        with open(_CAPABILITIES_CACHE_FILE, "r", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if cached.get("fingerprint") != fingerprint:
+        return None
+    capabilities = {key: set(cached.get("capabilities", {}).get(key, [])) for key in ("encoders", "pix_fmts", "muxers")}
+    capabilities["encoder_pix_fmts"] = cached.get("capabilities", {}).get("encoder_pix_fmts", {})
+    return capabilities
+
+
+def _store_cached_capabilities(fingerprint, capabilities):
+    serializable = {key: sorted(values) if isinstance(values, set) else values for key, values in capabilities.items()}
+    try:
+        with open(_CAPABILITIES_CACHE_FILE, "w", encoding="utf-8") as cache_file:
+            json.dump({"fingerprint": fingerprint, "capabilities": serializable}, cache_file)
+    except OSError as e_cache:
+        log_node_debug(RESOLVER_LOG_PREFIX, f"Could not write capability cache: {e_cache}")
+
+
+def get_ffmpeg_capabilities():
+    """Returns the resolved ffmpeg's encoders, pixel formats and muxers, or None if they can't be determined.
+
+    Probed once per process and cached on disk, keyed by the binary's path, mtime and size, so restarts
+    with an unchanged ffmpeg skip the probe.
+    """
+    global _CACHED_CAPABILITIES, _CACHED_FINGERPRINT
+    if _CACHED_CAPABILITIES is not None:
+        return _CACHED_CAPABILITIES or None
+    with _RESOLVE_LOCK:
+        if _CACHED_CAPABILITIES is None:
+            _CACHED_CAPABILITIES, _CACHED_FINGERPRINT = _load_capabilities(get_ffmpeg_path())
+    return _CACHED_CAPABILITIES or None
+
+
+def _load_capabilities(ffmpeg_path):
+    """Returns (capabilities, fingerprint), from the disk cache or a fresh probe. Capabilities are {} if unknown."""
+    try:
+        fingerprint = _binary_fingerprint(ffmpeg_path)
+    except OSError:
+        fingerprint = None
+    capabilities = _load_cached_capabilities(fingerprint) if fingerprint else None
+    if capabilities is not None:
+        log_node_debug(RESOLVER_LOG_PREFIX, f"Loaded ffmpeg capabilities from cache for {fingerprint['binary']}")
+    else:
+        try:
+            capabilities = probe_ffmpeg_capabilities(ffmpeg_path)
+            log_node_info(RESOLVER_LOG_PREFIX, f"Probed ffmpeg: {len(capabilities['encoders'])} encoders, "
+                          f"{len(capabilities['pix_fmts'])} pixel formats, {len(capabilities['muxers'])} muxers.")
+            if fingerprint:
+                _store_cached_capabilities(fingerprint, capabilities)
+        except Exception as e_probe:
+            log_node_warning(RESOLVER_LOG_PREFIX, f"Could not probe ffmpeg capabilities ({e_probe}). Options will not be pre-validated.")
+            capabilities = {}
+    return capabilities, fingerprint
+
+
+def get_encoder_pixel_formats(encoder):
+    """Returns the pixel formats `encoder` accepts (list), or None if unknown. Probed once per encoder and cached."""
+    capabilities = get_ffmpeg_capabilities()
+    if not capabilities or encoder not in capabilities["encoders"]:
+        return None
+    per_encoder = capabilities["encoder_pix_fmts"]
+    if encoder not in per_encoder:
+        try:
+            result = subprocess.run([get_ffmpeg_path(), '-hide_banner', '-h', f'encoder={encoder}'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, timeout=10, check=True)
+        except Exception as e_probe:
+            log_node_debug(RESOLVER_LOG_PREFIX, f"Could not probe encoder {encoder}: {e_probe}")
+            return None
+        pixel_formats = []
+        for line in result.stdout.decode('utf-8', errors='replace').splitlines():
+            if line.strip().startswith("Supported pixel formats:"):
+                pixel_formats = line.split(":", 1)[1].split()
+        per_encoder[encoder] = pixel_formats  # Empty means "not restricted" (e.g. wrappers that accept anything).
+        if _CACHED_FINGERPRINT:
+            _store_cached_capabilities(_CACHED_FINGERPRINT, capabilities)
+    return per_encoder[encoder] or None
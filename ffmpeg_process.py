@@ -0,0 +1,251 @@
+# ffmpeg_process.py
+import os
+import queue
+import subprocess
+import threading
+import time
+
+# Inherited extra pipes (pass_fds) are POSIX-only; callers fall back to temp files elsewhere.
+SUPPORTS_PIPE_INPUTS = os.name == "posix"
+
+# Adaptive timeout while a stdin write is blocked on ffmpeg and once its input is closed: it may go
+# TIMEOUT_FLOOR_SECONDS without encoding a frame, plus TIMEOUT_SPEED_FACTOR times what its remaining frames should
+# take at the measured speed. Each new frame renews it.
+TIMEOUT_FLOOR_SECONDS = 120.0
+TIMEOUT_SPEED_FACTOR = 4.0
+_WAIT_POLL_SECONDS = 0.5
+_STALLED_JOIN_SECONDS = 2.0  # How long to wait for pipe threads of a killed ffmpeg (a child of it may hold the pipes).
+
+
+def _drain_stream(stream, sink):
+    """Reads a pipe to EOF so ffmpeg never blocks on a full stdout/stderr buffer."""
+    try:
+        for block in iter(lambda: stream.read(65536), b''):
+            sink.append(block)
+    finally:
+        stream.close()
+
+
+class PipeFeeder:
+    """Feeds one bytes-like payload to ffmpeg through an extra inherited pipe, opened by ffmpeg as `pipe:<fd>`."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.read_fd, self.write_fd = os.pipe()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"pipe:{self.read_fd}"
+
+    def start(self):
+        """Called once the child has inherited read_fd: drops the parent's copy and starts writing."""
+        os.close(self.read_fd)
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        try:
+            with open(self.write_fd, 'wb') as pipe:
+                pipe.write(self.payload)
+        except BrokenPipeError:
+            pass  # ffmpeg stopped reading (e.g. -shortest); not an error.
+
+    def close(self, timeout=None):
+        """Waits for the writer, or releases both ends if the child was never started."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        else:
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+
+
+def _read_progress(stream, sink, ffmpeg_process):
+    """Reads ffmpeg's `-progress pipe:1` key=value blocks as they arrive; anything else is kept as stdout."""
+    block = {}
+    try:
+        for raw_line in iter(stream.readline, b''):
+            key, sep, value = raw_line.decode('utf-8', errors='replace').strip().partition('=')
+            if not sep:
+                if raw_line.strip():
+                    sink.append(raw_line)
+                continue
+            block[key] = value.strip()
+            if key == "progress":  # Last key of every block.
+                ffmpeg_process._update_progress(block)
+                block = {}
+    finally:
+        stream.close()
+
+
+class FFmpegProcess:
+    """An ffmpeg child whose stdin can be fed incrementally while stdout/stderr are drained on background threads.
+
+    `pipe_feeders` are PipeFeeder side inputs (e.g. PCM audio) written concurrently with stdin. ffmpeg reports
+    `-progress` on stdout; each parsed block (frame, fps, speed, out_time_us, ...) is kept in `progress` and passed
+    to `progress_callback`. `total_frames`, when known, sizes the stall timeout (see allowed_wait).
+
+    stdin is written on a helper thread while the caller waits, so an ffmpeg that stops reading is killed once a
+    write has been blocked for allowed_wait() without a new frame. Time between writes (producing frames, waiting
+    for a session's next window) never counts.
+    """
+
+    def __init__(self, ffmpeg_cmd, feed_stdin=True, pipe_feeders=(), total_frames=None, progress_callback=None):
+        self.ffmpeg_cmd = [ffmpeg_cmd[0], '-progress', 'pipe:1', '-nostats', *ffmpeg_cmd[1:]]
+        self.pipe_feeders = list(pipe_feeders)
+        self.total_frames = total_frames
+        self.progress_callback = progress_callback
+        self.progress = {}
+        self._started_at = self._frame_advanced_at = time.monotonic()
+        self._frames_done = 0
+        self._stalled_for = None
+        self._stdin_jobs = queue.Queue()
+        self._stdin_open = feed_stdin
+        try:
+            self.process = subprocess.Popen(
+                self.ffmpeg_cmd,
+                stdin=subprocess.PIPE if feed_stdin else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=tuple(feeder.read_fd for feeder in self.pipe_feeders),
+            )
+        except BaseException:
+            for feeder in self.pipe_feeders:
+                feeder.close()
+            raise
+        for feeder in self.pipe_feeders:
+            feeder.start()
+        self._stdout_blocks, self._stderr_blocks = [], []
+        self._readers = [
+            threading.Thread(target=_read_progress, args=(self.process.stdout, self._stdout_blocks, self), daemon=True),
+            threading.Thread(target=_drain_stream, args=(self.process.stderr, self._stderr_blocks), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+        if feed_stdin:
+            threading.Thread(target=self._stdin_writer, name="aimms-ffmpeg-stdin", daemon=True).start()
+
+    def _stdin_writer(self):
+        """Performs queued stdin writes (None closes stdin) and reports whether ffmpeg accepted them."""
+        while True:
+            chunk, done, result = self._stdin_jobs.get()
+            try:
+                if chunk is None:
+                    self.process.stdin.close()
+                else:
+                    self.process.stdin.write(chunk)
+                result.append(True)
+            except (BrokenPipeError, ValueError):
+                result.append(False)  # ffmpeg exited early (or stdin is already closed).
+            done.set()
+            if chunk is None:
+                return
+
+    def _stdin_call(self, chunk):
+        """Hands `chunk` to the writer thread and waits while ffmpeg keeps encoding. Kills ffmpeg and returns False
+        once the write has been blocked for allowed_wait() without a new frame."""
+        if self._stalled_for is not None:
+            return False
+        done, result = threading.Event(), []
+        self._stdin_jobs.put((chunk, done, result))
+        started_at = time.monotonic()
+        while not done.wait(_WAIT_POLL_SECONDS):
+            stalled_for = time.monotonic() - max(started_at, self._frame_advanced_at)
+            if stalled_for >= self.allowed_wait():
+                self._stalled_for = stalled_for
+                if self.process.poll() is None:
+                    self.process.kill()
+                return False
+        return result[0]
+
+    def _update_progress(self, block):
+        try:
+            frame = int(block.get("frame", 0))
+        except ValueError:
+            frame = 0
+        if frame > self._frames_done:
+            self._frames_done, self._frame_advanced_at = frame, time.monotonic()
+        self.progress = block
+        if self.progress_callback is not None:
+            self.progress_callback(block)
+
+    def allowed_wait(self):
+        """Seconds ffmpeg may go without a new frame before finish() gives up, from the frames left and measured speed."""
+        encode_seconds = self._frame_advanced_at - self._started_at
+        if not self.total_frames or self._frames_done <= 0 or encode_seconds <= 0:
+            return TIMEOUT_FLOOR_SECONDS
+        remaining_frames = max(0, self.total_frames - self._frames_done)
+        return TIMEOUT_FLOOR_SECONDS + TIMEOUT_SPEED_FACTOR * remaining_frames * encode_seconds / self._frames_done
+
+    def write(self, chunk):
+        """Writes a bytes-like chunk to stdin. Returns False if ffmpeg has already closed its end (its return code and
+        stderr tell the story) or stalled on it (finish() then raises TimeoutExpired)."""
+        return self._stdin_open and self._stdin_call(chunk)
+
+    def _close_stdin(self):
+        if self._stdin_open:
+            self._stdin_open = False
+            self._stdin_call(None)  # Closing flushes buffered frames, which can stall too.
+
+    def _collected_output(self):
+        join_timeout = _STALLED_JOIN_SECONDS if self._stalled_for is not None else None
+        for feeder in self.pipe_feeders:
+            feeder.close(join_timeout)
+        for reader in self._readers:
+            reader.join(join_timeout)
+        return (b''.join(self._stdout_blocks).decode('utf-8', errors='replace'),
+                b''.join(self._stderr_blocks).decode('utf-8', errors='replace'))
+
+    def finish(self, timeout=None):
+        """Closes stdin and waits for ffmpeg. Returns (returncode, stdout, stderr).
+
+        Without a fixed `timeout`, waits as long as ffmpeg keeps producing frames within allowed_wait().
+        Raises subprocess.TimeoutExpired (with output attached) when the wait runs out, or when ffmpeg was killed
+        for not reading its input.
+        """
+        self._close_stdin()
+        if self._stalled_for is not None:
+            stdout, stderr = self.kill()
+            raise subprocess.TimeoutExpired(self.ffmpeg_cmd, round(self._stalled_for, 1), output=stdout, stderr=stderr)
+        closed_at = time.monotonic()
+        while True:
+            try:
+                self.process.wait(timeout=_WAIT_POLL_SECONDS if timeout is None else timeout)
+                break
+            except subprocess.TimeoutExpired:
+                waited = time.monotonic() - closed_at
+                if timeout is None and time.monotonic() - max(closed_at, self._frame_advanced_at) < self.allowed_wait():
+                    continue
+                stdout, stderr = self.kill()
+                raise subprocess.TimeoutExpired(self.ffmpeg_cmd, round(waited, 1), output=stdout, stderr=stderr)
+        stdout, stderr = self._collected_output()
+        return self.process.returncode, stdout, stderr
+
+    def kill(self):
+        """Stops ffmpeg immediately (e.g. when frame production fails mid-stream). Returns (stdout, stderr) so far."""
+        if self.process.poll() is None:
+            self.process.kill()
+        self._close_stdin()
+        self.process.wait()
+        return self._collected_output()
+
+
+def run_ffmpeg(ffmpeg_cmd, stdin_chunks=None, timeout=None, pipe_feeders=(), total_frames=None, progress_callback=None):
+    """Runs ffmpeg, optionally feeding it raw bytes on stdin (and PipeFeeder side inputs) while it encodes.
+
+    `stdin_chunks` is an iterable of bytes-like objects (bytes, memoryview, C-contiguous numpy arrays).
+    Returns (returncode, stdout, stderr) with decoded output. Raises subprocess.TimeoutExpired
+    (with output attached) if ffmpeg stalls while being fed or after its input was closed (see FFmpegProcess).
+    """
+    ffmpeg_process = FFmpegProcess(ffmpeg_cmd, feed_stdin=stdin_chunks is not None, pipe_feeders=pipe_feeders,
+                                   total_frames=total_frames, progress_callback=progress_callback)
+    try:
+        if stdin_chunks is not None:
+            for chunk in stdin_chunks:
+                if not ffmpeg_process.write(chunk):
+                    break
+    except BaseException:
+        # Frame production failed mid-stream: don't leave a half-fed ffmpeg running.
+        ffmpeg_process.kill()
+        raise
+    return ffmpeg_process.finish(timeout=timeout)
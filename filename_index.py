@@ -0,0 +1,92 @@
+# filename_index.py
+import os
+import re
+import threading
+
+# "<prefix>_<NNN>.<ext>", the names get_unique_filename hands out once "<prefix>.<ext>" is taken.
+_COUNTER_NAME = re.compile(r"^(?P<prefix>.+)_(?P<counter>\d{3,})\.(?P<ext>[^.]+)$")
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+class DirectoryIndex:
+    """Names of one output folder and the highest `_NNN` counter per (prefix, extension), from a single scandir.
+
+    The index is only a hint: names are claimed with O_CREAT | O_EXCL, so a file created by someone else since
+    the scan is detected at claim time and skipped, never overwritten.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._names = set()
+        self._counters = {}
+        self._lock = threading.Lock()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                self._remember(entry.name)
+
+    def _remember(self, name):
+        self._names.add(name)
+        match = _COUNTER_NAME.match(name)
+        if match:
+            key = (match["prefix"], match["ext"])
+            self._counters[key] = max(self._counters.get(key, 0), int(match["counter"]))
+
+    def _highest_counter(self, prefix, extensions):
+        return max(self._counters.get((prefix, ext), 0) for ext in extensions)
+
+    def _claim(self, names):
+        """Creates every name as an empty placeholder, or none of them. Returns False if one already exists."""
+        created = []
+        try:
+            for name in names:
+                fd = os.open(os.path.join(self.path, name), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                os.close(fd)
+                created.append(name)
+        except FileExistsError:
+            self._remember(name)
+            for created_name in created:
+                os.remove(os.path.join(self.path, created_name))
+            return False
+        for name in names:
+            self._remember(name)
+        return True
+
+    def reserve(self, prefix, extensions):
+        """Claims `prefix.<ext>` for every extension, or else the same `prefix_NNN` stem above the highest counter
+        in use. Returns the claimed filenames, in `extensions` order."""
+        with self._lock:
+            counter = 0
+            while True:
+                stem = f"{prefix}_{counter:03d}" if counter else prefix
+                names = [f"{stem}.{ext}" for ext in extensions]
+                if not counter:
+                    # The bare names are the ones users delete to reuse; re-check just those instead of rescanning.
+                    self._names.difference_update(name for name in names if not os.path.lexists(os.path.join(self.path, name)))
+                if not any(name in self._names for name in names) and self._claim(names):
+                    return names
+                counter = max(counter, self._highest_counter(prefix, extensions)) + 1
+
+
+def reserve_filenames(directory, prefix, extensions):
+    """Reserves one free set of `prefix[_NNN].<ext>` names in `directory` (see DirectoryIndex.reserve).
+
+    The folder is scanned once per process; later calls only touch the names they claim.
+    """
+    key = os.path.normcase(os.path.abspath(directory))
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is None:
+            index = _INDEXES[key] = DirectoryIndex(directory)
+    return index.reserve(prefix, extensions)
+
+
+def release_filenames(paths):
+    """Removes reserved placeholders that were never written (still empty), e.g. after a failed encode."""
+    for path in paths:
+        try:
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+        except OSError:
+            pass
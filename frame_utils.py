@@ -0,0 +1,209 @@
+# frame_utils.py
+import numpy as np
+import torch
+
+# Frames quantized per device round-trip. Bounds the float32 scratch to a few frames instead of the whole clip.
+DEFAULT_CHUNK_FRAMES = 16
+
+
+def _check_batch(images):
+    if not isinstance(images, (torch.Tensor, np.ndarray, FrameStream)) or len(images.shape) != 4:
+        raise ValueError(f"Expected a (B, H, W, C) tensor, array or FrameStream, got {type(images)} with shape {getattr(images, 'shape', None)}.")
+    if images.shape[-1] not in (1, 3, 4):
+        raise ValueError(f"Unsupported channel count {images.shape[-1]} (expected 1, 3 or 4).")
+
+
+def _quantize_chunk(chunk):
+    """Clamps to [0, 1], scales to 0-255 and truncates to uint8 on the chunk's own device."""
+    if chunk.dtype == torch.uint8:
+        return chunk
+    scaled = chunk.to(torch.float32).clamp(0.0, 1.0)  # Always a new tensor, so the in-place mul never touches the input.
+    return scaled.mul_(255.0).to(torch.uint8)
+
+
+def _quantize_array(chunk):
+    """NumPy counterpart of _quantize_chunk. A uint8 chunk (e.g. a memmap slice) is only made contiguous."""
+    if chunk.dtype == np.uint8:
+        return np.ascontiguousarray(chunk)
+    scaled = np.clip(chunk.astype(np.float32), 0.0, 1.0)
+    return np.multiply(scaled, 255.0, out=scaled).astype(np.uint8)
+
+
+def _quantize_any(chunk):
+    """Quantizes a tensor or array chunk to a host uint8 ndarray."""
+    if isinstance(chunk, torch.Tensor):
+        with torch.no_grad():
+            return np.ascontiguousarray(_quantize_chunk(chunk.detach()).cpu().numpy())
+    return _quantize_array(np.asarray(chunk))
+
+
+class FrameStream:
+    """A clip that is read once, for batches that don't fit in memory: an iterable of (H, W, C) frames or
+    (n, H, W, C) chunks, as tensors or arrays (float in [0, 1] or uint8), e.g. a generator decoding from disk.
+
+    Frames are re-chunked into uint8 buffers of a fixed frame count, so only one buffer (plus the producer's own
+    item) is held at a time. The first frame is read up front for the frame size and kept as `first_frame`.
+    `shape` is (frame_count, H, W, C); frame_count is None until the stream is exhausted unless given.
+    """
+
+    def __init__(self, frames, frame_count=None):
+        self._items = iter(frames)
+        first_item = next(self._items, None)
+        if first_item is None:
+            raise ValueError("FrameStream has no frames.")
+        first_chunk = _quantize_any(first_item if len(first_item.shape) == 4 else first_item[None])
+        self._pending = first_chunk
+        self.first_frame = first_chunk[0].copy()
+        self.frame_count = frame_count
+        self._consumed = False
+
+    @property
+    def shape(self):
+        return (self.frame_count, *self.first_frame.shape)
+
+    def __len__(self):
+        if self.frame_count is None:
+            raise TypeError("FrameStream length is unknown until it has been read.")
+        return self.frame_count
+
+    def _iter_items(self):
+        yield self._pending
+        self._pending = None
+        for item in self._items:
+            chunk = _quantize_any(item if len(item.shape) == 4 else item[None])
+            if chunk.shape[1:] != self.first_frame.shape:
+                raise ValueError(f"FrameStream frame shape changed from {self.first_frame.shape} to {chunk.shape[1:]}.")
+            yield chunk
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_FRAMES):
+        """Yields (start_index, contiguous uint8 ndarray of up to chunk_size frames). Can only be called once."""
+        if self._consumed:
+            raise RuntimeError("FrameStream was already read; it can't be replayed.")
+        self._consumed = True
+        chunk_size = max(1, int(chunk_size))
+        buffer, filled, start = np.empty((chunk_size, *self.first_frame.shape), dtype=np.uint8), 0, 0
+        for item in self._iter_items():
+            offset = 0
+            while offset < item.shape[0]:
+                taken = min(chunk_size - filled, item.shape[0] - offset)
+                buffer[filled:filled + taken] = item[offset:offset + taken]
+                filled, offset = filled + taken, offset + taken
+                if filled == chunk_size:
+                    yield start, buffer
+                    # A fresh buffer per chunk: the consumer may still hold the previous one (e.g. a pipe writer).
+                    buffer, filled, start = np.empty_like(buffer), 0, start + chunk_size
+        if filled:
+            yield start, buffer[:filled]
+        self.frame_count = start + filled
+
+
+def open_frame_store(path):
+    """Memory-maps a (B, H, W, C) uint8 .npy frame store read-only. Slices are read from disk only when streamed."""
+    frames = np.load(path, mmap_mode="r")
+    _check_batch(frames)
+    return frames
+
+
+def create_frame_store(path, frame_count, height, width, channels=3):
+    """Creates a writable (B, H, W, C) uint8 .npy frame store for a producer to fill frame by frame."""
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(frame_count, height, width, channels))
+
+
+def iter_uint8_chunks(images, chunk_size=DEFAULT_CHUNK_FRAMES, indices=None):
+    """Yields (start_index, uint8 ndarray of shape (n, H, W, C)) for consecutive chunks of a (B, H, W, C) batch.
+
+    Each chunk is quantized on the tensor's device and copied to the host once; only one chunk of
+    float32 scratch exists at a time. NumPy batches (e.g. memory-mapped frame stores) are read a chunk at a time,
+    and a FrameStream is read through its own buffer. With `indices` (1-D LongTensor), only those frames are
+    emitted, in that order, and start_index counts emitted frames.
+    """
+    _check_batch(images)
+    chunk_size = max(1, int(chunk_size))
+    if isinstance(images, FrameStream):
+        if indices is not None:
+            raise ValueError("A FrameStream can't be read by index.")
+        yield from images.iter_chunks(chunk_size)
+        return
+    if isinstance(images, np.ndarray):
+        frame_count = images.shape[0] if indices is None else len(indices)
+        for start in range(0, frame_count, chunk_size):
+            if indices is None:
+                yield start, _quantize_array(images[start:start + chunk_size])
+            else:
+                yield start, _quantize_array(images[indices[start:start + chunk_size].numpy()])
+        return
+    frame_count = images.shape[0] if indices is None else len(indices)
+    with torch.no_grad():
+        for start in range(0, frame_count, chunk_size):
+            if indices is None:
+                chunk = images[start:start + chunk_size]
+            else:
+                chunk = images.index_select(0, indices[start:start + chunk_size].to(images.device))
+            quantized = _quantize_chunk(chunk)
+            yield start, np.ascontiguousarray(quantized.cpu().numpy())
+
+
+def tensor_batch_to_uint8(images, chunk_size=DEFAULT_CHUNK_FRAMES):
+    """Converts a whole (B, H, W, C) batch to one contiguous uint8 ndarray, quantizing chunk by chunk."""
+    _check_batch(images)
+    if isinstance(images, np.ndarray):
+        host = np.empty(images.shape, dtype=np.uint8)
+        for start, chunk in iter_uint8_chunks(images, chunk_size):
+            host[start:start + chunk.shape[0]] = chunk
+        return host
+    host = torch.empty(tuple(images.shape), dtype=torch.uint8)
+    chunk_size = max(1, int(chunk_size))
+    with torch.no_grad():
+        for start in range(0, images.shape[0], chunk_size):
+            host[start:start + chunk_size].copy_(_quantize_chunk(images[start:start + chunk_size]))
+    return host.numpy()
+
+
+def find_held_frames(images, chunk_size=DEFAULT_CHUNK_FRAMES):
+    """Returns a (B,) bool tensor that is True where a frame quantizes to exactly the same uint8 image as the
+    frame before it. Compared chunk by chunk on the tensor's device (on the host for NumPy batches)."""
+    _check_batch(images)
+    held = torch.zeros(images.shape[0], dtype=torch.bool)
+    chunk_size = max(2, int(chunk_size))
+    previous = None
+    with torch.no_grad():
+        for start in range(0, images.shape[0], chunk_size):
+            if isinstance(images, np.ndarray):
+                quantized = torch.from_numpy(_quantize_array(images[start:start + chunk_size]).copy())  # Writable, unlike a memmap view.
+            else:
+                quantized = _quantize_chunk(images[start:start + chunk_size])
+            if previous is not None:
+                held[start] = torch.equal(previous, quantized[0])
+            if quantized.shape[0] > 1:
+                held[start + 1:start + quantized.shape[0]] = (quantized[1:] == quantized[:-1]).flatten(1).all(dim=1).cpu()
+            previous = quantized[-1]
+    return held
+
+
+def plan_frame_holds(held, max_runs=None):
+    """Plans which held frames to drop. Returns (kept_indices, runs).
+
+    kept_indices is a LongTensor of the frames still sent. runs are (sent_index, dropped) pairs in order: from the
+    sent_index-th kept frame on, timestamps move `dropped` frames later. The last frame is always kept so the clip
+    keeps its duration. With max_runs, only the longest runs are collapsed.
+    """
+    held = held.tolist()
+    if held:
+        held[-1] = False
+    candidate_runs, run_start = [], None
+    for index, is_held in enumerate(held + [False]):
+        if is_held and run_start is None:
+            run_start = index
+        elif not is_held and run_start is not None:
+            candidate_runs.append((run_start, index - run_start))
+            run_start = None
+    if max_runs is not None and len(candidate_runs) > max_runs:
+        candidate_runs = sorted(sorted(candidate_runs, key=lambda run: run[1], reverse=True)[:max_runs])
+
+    keep = torch.ones(len(held), dtype=torch.bool)
+    runs, dropped_so_far = [], 0
+    for start, length in candidate_runs:
+        keep[start:start + length] = False
+        dropped_so_far += length
+        runs.append((start + length - dropped_so_far, length))
+    return keep.nonzero().flatten(), runs
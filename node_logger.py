@@ -1,4 +1,9 @@
 # node_logger.py
+import contextlib
+import json
+import os
+import threading
+import time
 
 # ANSI color dictionary
 COLORS = {
@@ -69,3 +74,171 @@ def log_node_error(node_name, message, msg_color_override='BRIGHT_RED'):
 # If you have log_node_debug or log_node_message, you also need to check/fix them:
 def log_node_debug(node_name, message, msg_color_override='GREY'):
     _log_node("MAGENTA", node_name, message, msg_color=msg_color_override) 
+
+
+# --- Encode metrics ---------------------------------------------------------
+# Structured per-run instrumentation for save_video: stage spans, counters, ffmpeg -progress values and CPU time.
+# Off unless AIMMS_METRICS is set ("1"/"log" prints a summary per run), AIMMS_METRICS_FILE names a JSON lines file,
+# or a hook is registered with add_metrics_hook(). When off, start_encode_metrics() hands out a no-op recorder.
+
+METRICS_ENV_VAR = "AIMMS_METRICS"
+METRICS_FILE_ENV_VAR = "AIMMS_METRICS_FILE"
+
+_METRICS_HOOKS = []
+_METRICS_FILE_LOCK = threading.Lock()
+
+
+def add_metrics_hook(hook):
+  """Registers hook(record_dict), called after every save_video run. Registering a hook enables metrics."""
+  _METRICS_HOOKS.append(hook)
+
+
+def remove_metrics_hook(hook):
+  if hook in _METRICS_HOOKS:
+    _METRICS_HOOKS.remove(hook)
+
+
+def metrics_enabled():
+  return bool(_METRICS_HOOKS or os.environ.get(METRICS_ENV_VAR) or os.environ.get(METRICS_FILE_ENV_VAR))
+
+
+class _NullMetrics:
+  """Recorder handed out when metrics are disabled; every call is a no-op."""
+  enabled = False
+
+  def span(self, stage):
+    return contextlib.nullcontext()
+
+  def wrap_frames(self, chunks):
+    return chunks
+
+  def add(self, counter, value):
+    pass
+
+  def set(self, key, value):
+    pass
+
+  def record_ffmpeg_progress(self, progress):
+    pass
+
+  def finish(self, success, **fields):
+    pass
+
+
+NULL_METRICS = _NullMetrics()
+
+
+class EncodeMetrics:
+  """Metrics of one save_video run. Safe to use from the segment and background worker threads."""
+  enabled = True
+
+  def __init__(self, node_name, label):
+    self.node_name = node_name
+    self.label = label
+    self.stages = {}
+    self.counters = {}
+    self.fields = {}
+    self.ffmpeg_progress = []
+    self._lock = threading.Lock()
+    self._started = time.perf_counter()
+    self._started_cpu = time.process_time()
+    self._started_children_cpu = _children_cpu_seconds()
+
+  @contextlib.contextmanager
+  def span(self, stage):
+    """Times a block; repeated or concurrent spans of the same stage are summed."""
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self._add_stage(stage, time.perf_counter() - started)
+
+  def wrap_frames(self, chunks):
+    """Passes uint8 frame chunks through, timing their production as `frame_conversion` and counting frames and bytes."""
+    chunks = iter(chunks)
+    while True:
+      started = time.perf_counter()
+      chunk = next(chunks, None)
+      self._add_stage("frame_conversion", time.perf_counter() - started)
+      if chunk is None:
+        return
+      self.add("frames_piped", len(chunk))
+      self.add("bytes_piped", chunk.nbytes)
+      yield chunk
+
+  def _add_stage(self, stage, seconds):
+    with self._lock:
+      self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+  def add(self, counter, value):
+    with self._lock:
+      self.counters[counter] = self.counters.get(counter, 0) + value
+
+  def set(self, key, value):
+    with self._lock:
+      self.fields[key] = value
+
+  def record_ffmpeg_progress(self, progress):
+    """Keeps the final -progress block of one ffmpeg run (frame, fps, speed, total_size, out_time, ...)."""
+    if progress:
+      with self._lock:
+        self.ffmpeg_progress.append(progress)
+
+  def finish(self, success, **fields):
+    """Closes the run and emits it to the log, the JSON lines file and the hooks."""
+    wall = time.perf_counter() - self._started
+    record = {
+      "timestamp": time.time(),
+      "node": self.node_name,
+      "label": self.label,
+      "success": bool(success),
+      "wall_seconds": round(wall, 4),
+      "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+      "counters": dict(self.counters),
+      "cpu_seconds": round(time.process_time() - self._started_cpu, 4),
+      "ffmpeg_cpu_seconds": round(_children_cpu_seconds() - self._started_children_cpu, 4),
+      "ffmpeg_progress": self.ffmpeg_progress,
+      **self.fields,
+      **fields,
+    }
+    frames = record.get("frames")
+    encode_seconds = record["stages"].get("encode")
+    if success and frames and encode_seconds:
+      record["encode_fps"] = round(frames / encode_seconds, 2)
+    _emit_metrics(record)
+    return record
+
+
+def _children_cpu_seconds():
+  """CPU time of finished child processes (ffmpeg). Process-wide, so overlapping encodes share it."""
+  times = os.times()
+  return times.children_user + times.children_system
+
+
+def start_encode_metrics(node_name, label):
+  """Returns an EncodeMetrics recorder for one run, or NULL_METRICS when instrumentation is off."""
+  if not metrics_enabled():
+    return NULL_METRICS
+  return EncodeMetrics(node_name, label)
+
+
+def _emit_metrics(record):
+  mode = os.environ.get(METRICS_ENV_VAR, "").lower()
+  if mode in ("1", "true", "log"):
+    stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in record["stages"].items())
+    fps = f", {record['encode_fps']} fps" if "encode_fps" in record else ""
+    log_node_info(record["node"], f"Metrics for {record['label']}: {record['wall_seconds']:.3f}s{fps} "
+                  f"(cpu {record['cpu_seconds']:.2f}s, ffmpeg cpu {record['ffmpeg_cpu_seconds']:.2f}s) [{stages}] {record['counters']}",
+                  msg_color_override="GREY")
+  metrics_file = os.environ.get(METRICS_FILE_ENV_VAR)
+  if metrics_file:
+    try:
+      with _METRICS_FILE_LOCK, open(metrics_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    except OSError as e:
+      log_node_warning(record["node"], f"Could not write metrics to {metrics_file}: {e}")
+  for hook in list(_METRICS_HOOKS):
+    try:
+      hook(record)
+    except Exception as e:
+      log_node_warning(record["node"], f"Metrics hook {hook!r} failed: {e}")
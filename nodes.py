@@ -3,17 +3,51 @@ import os
 import configparser
 import tempfile
 import numpy as np
-from PIL import Image
-from PIL.PngImagePlugin import PngInfo
 import folder_paths
 import torch
-import torchaudio
 import json
-from .ffmpeg_path_resolver import get_ffmpeg_path
-from .node_logger import log_node_info, log_node_success, log_node_error, log_node_warning, log_node_debug
+from concurrent.futures import ThreadPoolExecutor
+from .ffmpeg_path_resolver import get_ffmpeg_path, get_ffmpeg_capabilities, get_encoder_pixel_formats
+from .ffmpeg_process import run_ffmpeg, FFmpegProcess, PipeFeeder, SUPPORTS_PIPE_INPUTS
+from .frame_utils import iter_uint8_chunks, tensor_batch_to_uint8, find_held_frames, plan_frame_holds, FrameStream, DEFAULT_CHUNK_FRAMES
+from .encode_worker import get_background_encoder
+from .segmented_encode import segment_gop_size, plan_segments, resolve_worker_count, write_concat_list, SEGMENT_CONTAINER
+from .encoder_profiles import PERFORMANCE_PROFILES, encoder_profile_args, find_hardware_encoders, mark_hardware_encoders_failed
+from .video_session import (VideoSession, session_key, acquire_session, release_session, register_session, pop_session,
+                            discard_session, reaped_session)
+from .node_logger import (log_node_info, log_node_success, log_node_error, log_node_warning, log_node_debug,
+                          start_encode_metrics, NULL_METRICS)
+from .encode_progress import EncodeProgress
+from .filename_index import reserve_filenames, release_filenames
+from .encode_cache import get_encode_cache, batch_digest, encode_cache_key, unshare_file
 
 class SaveFramesToVideoFFmpeg:
     NODE_LOG_PREFIX = "SaveVideoFFMPEG"  # Class attribute for logging
+    RAW_PIXEL_FORMATS = {1: "gray", 3: "rgb24", 4: "rgba"}  # Channel count -> ffmpeg rawvideo pix_fmt
+    VIDEO_CODECS = ["libx264", "libx265", "libvpx-vp9", "libsvtav1"]
+    PIXEL_FORMATS = ["yuv420p", "yuv444p", "yuv422p", "yuv420p10le", "yuv422p10le", "yuv444p10le", "rgb24"]
+    OUTPUT_FORMATS = ["mp4", "webm", "mov", "avi", "mkv"]
+    AUDIO_CODECS = ["aac", "mp3", "libopus", "copy"]
+    # Codec choice -> encoders of the same family, fastest first. Used when the requested encoder is missing.
+    CODEC_FAMILIES = {
+        "libx264": ["libx264"],
+        "libx265": ["libx265"],
+        "libvpx-vp9": ["libvpx-vp9"],
+        "libsvtav1": ["libsvtav1", "librav1e", "libaom-av1"],
+    }
+    AUDIO_ENCODERS = {"aac": ["aac", "libfdk_aac"], "mp3": ["libmp3lame", "libshine"], "libopus": ["libopus"]}
+    CONTAINER_MUXERS = {"mp4": "mp4", "webm": "webm", "mov": "mov", "avi": "avi", "mkv": "matroska"}
+    # png_sequence intermediates: file extension, Pillow save options and the channel counts ffmpeg reads back exactly
+    # (Pillow writes grayscale BMP as a palette image, and neither BMP nor PPM carries alpha).
+    SEQUENCE_FORMATS = {
+        "png": ("png", {"format": "PNG"}, (1, 3, 4)),
+        "png_uncompressed": ("png", {"format": "PNG", "compress_level": 0}, (1, 3, 4)),
+        "bmp": ("bmp", {"format": "BMP"}, (3,)),
+        "ppm": ("ppm", {"format": "PPM"}, (1, 3)),
+    }
+    # Budget for the held-frame setpts expressions of all outputs; keeps the command under Windows' 32767 characters.
+    HOLD_FILTER_MAX_CHARS = 24000
+    HOLD_FILTER_CHARS_PER_RUN = 24
 
     def __init__(self):
         self.output_dir = folder_paths.get_output_directory()
@@ -25,13 +59,13 @@ class SaveFramesToVideoFFmpeg:
     def INPUT_TYPES(cls):
         return {
             "required": {
-                "images": ("IMAGE", {"tooltip": "Input image sequence to be converted to video. Expects a tensor of shape (B, H, W, C) where B is the number of frames."}),
+                "images": ("IMAGE", {"tooltip": "Input image sequence to be converted to video. Expects a tensor of shape (B, H, W, C) where B is the number of frames. Nodes that produce clips too large for memory can pass a memory-mapped uint8 NumPy array or a FrameStream instead."}),
                 "filename_prefix": ("STRING", {"default": "video", "tooltip": "Prefix for the output video filename."}),
                 "foldername_prefix": ("STRING", {"default": "videos", "tooltip": "Name of the subfolder within the output directory where videos will be saved."}),
                 "fps": ("FLOAT", {"default": 16.0, "min": 1.0, "max": 120.0, "step": 1.0, "tooltip": "Frames per second for the output video. Higher values create smoother but shorter videos."}),
-                "codec": (["libx264", "libx265", "libvpx-vp9", "libsvtav1"], {"default": "libx264", "tooltip": "Video codec to use for encoding. libx264 is most compatible, libx265 is more efficient, libvpx-vp9 for webm, libsvtav1 for AV1."}),
-                "pixel_format": (["yuv420p", "yuv444p", "yuv422p", "yuv420p10le", "yuv422p10le", "yuv444p10le", "rgb24"], {"default": "yuv420p", "tooltip": "Pixel format for the video. yuv420p is most widely compatible. Higher bit depths (10le) preserve more color information."}),
-                "output_format": (["mp4", "webm", "mov", "avi", "mkv"], {"default": "mp4", "tooltip": "Container format for the output video. mp4 is most widely supported."}),
+                "codec": (cls.VIDEO_CODECS, {"default": "libx264", "tooltip": "Video codec to use for encoding. libx264 is most compatible, libx265 is more efficient, libvpx-vp9 for webm, libsvtav1 for AV1."}),
+                "pixel_format": (cls.PIXEL_FORMATS, {"default": "yuv420p", "tooltip": "Pixel format for the video. yuv420p is most widely compatible. Higher bit depths (10le) preserve more color information."}),
+                "output_format": (cls.OUTPUT_FORMATS, {"default": "mp4", "tooltip": "Container format for the output video. mp4 is most widely supported."}),
                 "save_metadata": (["disabled", "enabled"], {"default": "enabled", "tooltip": "Whether to save prompt metadata as a separate PNG file alongside the video."}),
                 "overwrite_existing": ("BOOLEAN", {"default": False, "tooltip": "If enabled, overwrites existing files with the same name. If disabled, appends a counter to avoid overwriting."}),
                 "show_preview": ("BOOLEAN", {"default": True, "tooltip": "Whether to show a preview of the generated video in the node interface."}),
@@ -39,8 +73,23 @@ class SaveFramesToVideoFFmpeg:
             },
             "optional": {
                 "audio": ("AUDIO", {"tooltip": "Optional audio. Expects {'waveform': tensor, 'sample_rate': int}."}),
-                "audio_codec": (["aac", "mp3", "libopus", "copy"], {"default": "aac", "tooltip": "Audio codec for encoding. aac is most compatible, libopus for webm, copy to preserve original audio encoding."}),
+                "audio_codec": (cls.AUDIO_CODECS, {"default": "aac", "tooltip": "Audio codec for encoding. aac is most compatible, libopus for webm, copy to preserve original audio encoding."}),
                 "audio_bitrate": (["96k", "128k", "160k", "192k", "256k", "320k"], {"default": "192k", "tooltip": "Audio bitrate. Higher values preserve more audio quality but create larger files."}),
+                "frame_transport": (["rawvideo_pipe", "png_sequence"], {"default": "rawvideo_pipe", "tooltip": "How frames reach ffmpeg. rawvideo_pipe streams raw pixels over stdin while ffmpeg encodes (no temp files). png_sequence writes a temporary PNG per frame first (fallback)."}),
+                "sequence_format": (list(cls.SEQUENCE_FORMATS), {"default": "png", "tooltip": "Intermediate image format for frame_transport png_sequence. png_uncompressed, bmp and ppm skip compression: much faster to write, larger temporary files. Frames a format can't hold exactly (RGBA in bmp/ppm, grayscale in bmp) are written as uncompressed PNG."}),
+                "sequence_workers": ("INT", {"default": 0, "min": 0, "max": 64, "tooltip": "Threads writing png_sequence frames in parallel. 0 = one per CPU core."}),
+                "encode_mode": (["blocking", "background"], {"default": "blocking", "tooltip": "blocking waits for ffmpeg to finish. background queues the encode on a bounded worker pool and returns immediately; completion and errors are reported in the console."}),
+                "additional_outputs": ("STRING", {"default": "", "multiline": True, "tooltip": "Extra encodes of the same frames, one per line: codec,pixel_format,output_format[,audio_codec] (e.g. libvpx-vp9,yuv420p,webm,libopus). Frames are converted once and fed to a single ffmpeg process with one output per line."}),
+                "segments": ("INT", {"default": 1, "min": 1, "max": 64, "tooltip": "Split the frames into this many GOP-aligned chunks encoded by parallel ffmpeg processes, then join them without re-encoding (audio is muxed once at the end). 1 disables segmenting. Always streams raw frames."}),
+                "segment_workers": ("INT", {"default": 0, "min": 0, "max": 64, "tooltip": "Parallel ffmpeg processes for segmented encoding. 0 = one per segment, capped at the CPU count."}),
+                "performance_profile": (PERFORMANCE_PROFILES, {"default": "balanced", "tooltip": "Encoder speed/size trade-off. balanced keeps the classic settings (crf 19 for x264/x265, crf 35 for AV1); fastest uses quicker presets; smallest uses slower presets and higher crf for smaller files."}),
+                "prefer_hardware_encoder": ("BOOLEAN", {"default": False, "tooltip": "Use a GPU encoder (NVENC, QSV, AMF, VideoToolbox) for the chosen codec when this ffmpeg has one. If a hardware encode fails, the next hardware encoder this ffmpeg lists is tried, then the software codec; encoders that failed are skipped until ComfyUI restarts. Hardware encoders use their own quality settings, not the profile's crf."}),
+                "append_session": ("BOOLEAN", {"default": False, "tooltip": "Append these frames to a running video session keyed by folder and filename_prefix instead of writing a new file. The first call starts ffmpeg; later calls stream more frames into it, so only one window of frames is held in memory."}),
+                "finalize_session": ("BOOLEAN", {"default": True, "tooltip": "With append_session: close the session after this window and mux the final video (audio from this call is added). Turn off for every window except the last."}),
+                "reset_session": ("BOOLEAN", {"default": False, "tooltip": "With append_session: discard any unfinished session for this folder and filename_prefix (e.g. left over from a cancelled run) so this window starts a new video. Enable it on the first window. Unfinalized sessions idle for longer than idle_timeout_hours in ffmpeg_config.ini (default 6) are discarded."}),
+                "deduplicate_frames": ("BOOLEAN", {"default": False, "tooltip": "Send runs of identical frames (after 8-bit quantization) to ffmpeg once; ffmpeg repeats them back at the original timestamps. Saves conversion and pipe work on hold-heavy animation; duration and frame count are unchanged. Not applied to segmented encodes or append sessions."}),
+                "buffer_frames": ("INT", {"default": DEFAULT_CHUNK_FRAMES, "min": 1, "max": 1024, "tooltip": "Frames converted to 8-bit and held at once while streaming to ffmpeg, comparing held frames and hashing for the encode cache. Bounds the conversion memory regardless of clip length; lower it for 4K and long clips."}),
+                "encode_cache": ("BOOLEAN", {"default": False, "tooltip": "Reuse an earlier encode of exactly the same frames, audio and settings from the local encode cache (hardlinked or copied) instead of running ffmpeg again. New encodes are added to the cache, which drops its least recently used videos past its size limit (see ffmpeg_config.ini)."}),
             },
             "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO"},
         }
@@ -59,6 +108,7 @@ class SaveFramesToVideoFFmpeg:
         return str(subfolder_path)
 
     def save_metadata_to_png(self, image_tensor, prompt, extra_pnginfo, output_path, filename):
+        from PIL.PngImagePlugin import PngInfo  # Deferred with the rest of Pillow (see tensor_to_pil).
         try:
             img_pil = self.tensor_to_pil(image_tensor)
             metadata = PngInfo()
@@ -76,25 +126,38 @@ class SaveFramesToVideoFFmpeg:
             return None
 
     def get_unique_filename(self, output_path, filename_prefix, output_format, save_metadata, overwrite_existing):
+        """Returns (video_filename, png_filename). Unless overwriting, the names are reserved on disk as empty
+        placeholders (the PNG only when metadata is saved), so concurrent saves can't be handed the same name."""
         base_video_filename = f"{filename_prefix}.{output_format}"
         base_png_filename = f"{filename_prefix}.png"
         if overwrite_existing:
             return base_video_filename, base_png_filename
-        counter = 1
-        video_filename = base_video_filename
-        png_filename = base_png_filename
-        while os.path.exists(os.path.join(output_path, video_filename)) or \
-              (save_metadata == "enabled" and os.path.exists(os.path.join(output_path, png_filename))):
-            video_filename = f"{filename_prefix}_{counter:03d}.{output_format}"
-            png_filename = f"{filename_prefix}_{counter:03d}.png"
-            counter += 1
+        if save_metadata == "enabled":
+            video_filename, png_filename = reserve_filenames(output_path, filename_prefix, [output_format, "png"])
+        else:
+            video_filename, = reserve_filenames(output_path, filename_prefix, [output_format])
+            png_filename = f"{os.path.splitext(video_filename)[0]}.png"
         return video_filename, png_filename
 
+    def get_output_folder(self, filename_prefix, foldername_prefix):
+        """Returns (folder, filename stem): filename_prefix is split as folder_paths.get_save_image_path splits it (but
+        without listing the folder for a counter this node doesn't use) and foldername_prefix is appended to its folder.
+        Raises ValueError if the result is outside the output directory."""
+        output_dir = os.path.abspath(self.output_dir)
+        output_path = os.path.abspath(os.path.join(output_dir, os.path.dirname(os.path.normpath(filename_prefix)), foldername_prefix))
+        if os.path.commonpath((output_dir, output_path)) != output_dir:
+            raise ValueError(f"filename_prefix '{filename_prefix}' with foldername_prefix '{foldername_prefix}' points outside the output directory.")
+        return output_path, os.path.basename(os.path.normpath(filename_prefix))
+
     def save_video(self, images, filename_prefix, foldername_prefix, fps, codec, pixel_format, output_format,
                    save_metadata="enabled", overwrite_existing=False, show_preview=True, ffmpeg_verbose="info",
-                   audio=None, audio_codec="aac", audio_bitrate="192k", prompt=None, extra_pnginfo=None):
+                   audio=None, audio_codec="aac", audio_bitrate="192k", frame_transport="rawvideo_pipe",
+                   encode_mode="blocking", additional_outputs="", segments=1, segment_workers=0,
+                   performance_profile="balanced", prefer_hardware_encoder=False, append_session=False,
+                   finalize_session=True, reset_session=False, deduplicate_frames=False, buffer_frames=DEFAULT_CHUNK_FRAMES, encode_cache=False,
+                   sequence_format="png", sequence_workers=0, prompt=None, extra_pnginfo=None):
 
-        if not isinstance(images, torch.Tensor) or images.ndim != 4:
+        if not isinstance(images, (torch.Tensor, np.ndarray, FrameStream)) or len(images.shape) != 4:
             error_msg = f"Error: Expected 4D tensor for images, got {type(images)}"
             if hasattr(images, 'shape'):
                 error_msg += f" with shape {images.shape}"
@@ -104,144 +167,739 @@ class SaveFramesToVideoFFmpeg:
             error_msg = "Error: No frames to process (batch_size is 0)."
             log_node_error(self.NODE_LOG_PREFIX, error_msg)
             return {"ui": {"text": [error_msg]}}
+        if isinstance(images, FrameStream):
+            # Read once, front to back: no second pass (dedup, cache key), no split, and no replay for a hardware retry.
+            ignored = [name for name, used in (("background", encode_mode == "background"), ("segments", segments > 1),
+                                               ("deduplicate_frames", deduplicate_frames), ("encode_cache", encode_cache)) if used]
+            if ignored:
+                log_node_warning(self.NODE_LOG_PREFIX, f"Frame streams are read once; ignoring {'/'.join(ignored)}.")
+            encode_mode, segments, deduplicate_frames, encode_cache = "blocking", 1, False, False
+            prefer_hardware_encoder = False
 
-        h, w = images[0].shape[0], images[0].shape[1]
-        full_output_folder, filename_part_returned, counter, _, _ = folder_paths.get_save_image_path(
-            filename_prefix, self.output_dir, w, h
-        )
-        output_path = os.path.join(full_output_folder, foldername_prefix)
-        os.makedirs(output_path, exist_ok=True)
+        try:
+            extra_targets = self.parse_output_targets(additional_outputs, audio_codec)
+        except ValueError as e_targets:
+            error_msg = f"Error: {e_targets}"
+            log_node_error(self.NODE_LOG_PREFIX, error_msg)
+            return {"ui": {"text": [error_msg]}}
+
+        # Check the encode settings against the probed ffmpeg before any frame work.
+        targets = [{"codec": codec, "pixel_format": pixel_format, "output_format": output_format, "audio_codec": audio_codec}] + extra_targets
+        for target in targets:
+            target["profile"] = performance_profile
+        # Sessions can't replay earlier windows, so they stay on software encoders that won't fail mid-stream.
+        error_msg = self.resolve_encoders(targets, audio is not None, prefer_hardware_encoder and not append_session)
+        if error_msg:
+            log_node_error(self.NODE_LOG_PREFIX, error_msg)
+            return {"ui": {"text": [error_msg]}}
+
+        metrics = start_encode_metrics(self.NODE_LOG_PREFIX, filename_prefix)
+        metrics.set("frames", images.shape[0])
+        metrics.set("resolution", f"{images.shape[2]}x{images.shape[1]}")
+        metrics.set("encoders", [target["codec"] for target in targets])
+
+        try:
+            output_path, filename = self.get_output_folder(filename_prefix, foldername_prefix)
+            os.makedirs(output_path, exist_ok=True)
+        except (ValueError, OSError) as e_folder:
+            log_node_error(self.NODE_LOG_PREFIX, f"Error: {e_folder}")
+            return {"ui": {"text": [f"Error: {e_folder}"]}}
+
+        if append_session:
+            if encode_mode == "background" or segments > 1 or deduplicate_frames or encode_cache:
+                log_node_warning(self.NODE_LOG_PREFIX, "append_session streams into one live ffmpeg; ignoring encode_mode/segments/deduplicate_frames/encode_cache.")
+            metrics.set("mode", "session")
+            with metrics.span("encode"):
+                response, output_paths = self.append_to_session(images, output_path, filename, fps, targets, save_metadata,
+                                                           overwrite_existing, show_preview, ffmpeg_verbose, audio, audio_bitrate,
+                                                           finalize_session, prompt, extra_pnginfo, metrics, buffer_frames,
+                                                           reset_session)
+            self.finish_metrics(metrics, output_paths is not None, output_paths or [])
+            return response
 
         # Get unique filenames to avoid overwriting
-        video_filename, png_filename = self.get_unique_filename(output_path, filename_prefix, output_format, save_metadata, overwrite_existing)
-        video_full_path = os.path.join(output_path, video_filename)
+        try:
+            video_filename, png_filename = self.plan_target_paths(output_path, filename, targets, save_metadata, overwrite_existing)
+        except OSError as e_reserve:
+            log_node_error(self.NODE_LOG_PREFIX, f"Error: could not reserve an output filename in {output_path}: {e_reserve}")
+            return {"ui": {"text": [f"Error: could not reserve an output filename in {output_path}: {e_reserve}"]}}
+        video_full_path = targets[0]["path"]
 
-        temp_audio_file_for_ffmpeg = None
         preview_files_for_ui = []
         
         # Only add preview files if show_preview is True
         if show_preview:
             preview_files_for_ui.append({"filename": video_filename, "subfolder": self.get_subfolder_path(video_full_path, self.output_dir), "type": self.type})
 
+        if save_metadata == "enabled" and images.shape[0] != 0:
+            with metrics.span("metadata_png"):
+                png_file_path = self.save_metadata_to_png(self.first_frame(images), prompt, extra_pnginfo, output_path, png_filename.replace(".png", ""))
+            if png_file_path is None:
+                release_filenames([os.path.join(output_path, png_filename)])
+            elif show_preview:
+                preview_files_for_ui.append({
+                    "filename": png_filename,
+                    "subfolder": self.get_subfolder_path(png_file_path, self.output_dir),
+                    "type": self.type
+                })
+
+        ui_response_content = {"images": preview_files_for_ui, "animated": (True,)}
+        output_paths = [target["path"] for target in targets]
+        cache_digest, cache_settings = None, dict(fps=fps, audio_bitrate=audio_bitrate, deduplicate_frames=deduplicate_frames)
+        if encode_cache:
+            with metrics.span("cache_lookup"):
+                cache_digest = batch_digest(images, audio, buffer_frames)
+                cache_hit = self.restore_cached_targets(self.encode_cache_keys(cache_digest, targets, **cache_settings), targets)
+            if cache_hit:
+                metrics.set("mode", "cached")
+                for target in targets:
+                    log_node_success(self.NODE_LOG_PREFIX, f"Video restored from encode cache: {target['path']}")
+                self.finish_metrics(metrics, True, output_paths)
+                return {"ui": ui_response_content}
+
+        encode_args = dict(fps=fps, audio=audio, audio_bitrate=audio_bitrate, frame_transport=frame_transport,
+                           ffmpeg_verbose=ffmpeg_verbose, segments=segments, segment_workers=segment_workers, metrics=metrics,
+                           deduplicate_frames=deduplicate_frames, buffer_frames=buffer_frames, sequence_format=sequence_format,
+                           sequence_workers=sequence_workers)
+
+        if encode_mode == "background":
+            # Detach from the executor's tensors: quantize once to host uint8 (a quarter of the float32 size) and copy audio.
+            # A uint8 memmap is already detached and on disk; it is streamed from there.
+            metrics.set("mode", "background")
+            try:
+                with metrics.span("frame_conversion"):
+                    if isinstance(images, np.memmap) and images.dtype == np.uint8:
+                        frames_uint8 = images
+                    else:
+                        frames_uint8 = torch.from_numpy(tensor_batch_to_uint8(images, buffer_frames))
+            except Exception as e_frame:
+                log_node_error(self.NODE_LOG_PREFIX, f"Error processing frames: {e_frame}")
+                return {"ui": {"text": [f"Error processing frames: {e_frame}"]}}
+            if isinstance(audio, dict) and isinstance(audio.get("waveform"), torch.Tensor):
+                encode_args["audio"] = {**audio, "waveform": audio["waveform"].detach().cpu().clone()}
+
+            def background_job():
+                with metrics.span("encode"):
+                    result = self.encode_video(frames_uint8, targets, **encode_args)
+                self.finish_metrics(metrics, result[0], output_paths)
+                if not result[0]:
+                    release_filenames(output_paths)
+                elif cache_digest:
+                    self.store_cached_targets(self.encode_cache_keys(cache_digest, targets, **cache_settings), targets)
+                return result
+
+            get_background_encoder().submit(video_full_path, background_job)
+            log_node_info(self.NODE_LOG_PREFIX, f"Queued background encode: {video_full_path}")
+            return {"ui": {"text": [f"Encoding in background: {video_full_path}"]}}
+
+        metrics.set("mode", "blocking")
+        with metrics.span("encode"):
+            success, message = self.encode_video(images, targets, progress=EncodeProgress(images.shape[0] or 0), **encode_args)
+        metrics.set("frames", images.shape[0])  # A FrameStream knows its length only once it has been read.
+        self.finish_metrics(metrics, success, output_paths)
+        if not success:
+            release_filenames(output_paths)
+            return {"ui": {"text": [message]}}
+        if cache_digest:
+            # Keyed after the encode: a hardware fallback changes target["codec"] to the encoder that wrote the file.
+            self.store_cached_targets(self.encode_cache_keys(cache_digest, targets, **cache_settings), targets)
+        return {"ui": ui_response_content}
+
+    def encode_video(self, images, targets, fps, audio=None, audio_bitrate="192k", frame_transport="rawvideo_pipe",
+                     ffmpeg_verbose="info", segments=1, segment_workers=0, metrics=NULL_METRICS, progress=None,
+                     deduplicate_frames=False, buffer_frames=DEFAULT_CHUNK_FRAMES, sequence_format="png", sequence_workers=0):
+        """Encodes a (B, H, W, C) batch (float or uint8) to every target. Returns (success, message).
+
+        `targets` are dicts with codec, pixel_format, output_format, audio_codec, profile and path (the first one is
+        the main video); they all become outputs of the same ffmpeg process, so the frames are converted and decoded
+        only once. Targets that carry `fallback_codecs` (hardware encoders) are re-encoded with the next one on failure.
+        `progress` is an optional EncodeProgress fed from ffmpeg's -progress output. With `deduplicate_frames`, runs of
+        identical frames are sent once and repeated by ffmpeg. `images` may also be a NumPy
+        batch (e.g. a memmapped frame store) or a FrameStream; at most `buffer_frames` converted frames are held.
+        `sequence_format` and `sequence_workers` apply to the png_sequence transport (see write_png_sequence).
+        """
+        encode_args = dict(fps=fps, audio=audio, audio_bitrate=audio_bitrate, frame_transport=frame_transport,
+                           ffmpeg_verbose=ffmpeg_verbose, segments=segments, segment_workers=segment_workers, metrics=metrics,
+                           progress=progress, deduplicate_frames=deduplicate_frames, buffer_frames=buffer_frames,
+                           sequence_format=sequence_format, sequence_workers=sequence_workers)
+        success, message = self.encode_targets(images, targets, **encode_args)
+        attempted_hardware = set()
+        while not success and any(target.get("fallback_codecs") for target in targets):
+            for target in targets:
+                if target.get("fallback_codecs"):
+                    attempted_hardware.add(target["codec"])
+                    target["codec"] = target["fallback_codecs"].pop(0)
+            log_node_warning(self.NODE_LOG_PREFIX, f"Hardware encode failed; retrying with {', '.join(target['codec'] for target in targets)}.")
+            metrics.add("encoder_fallbacks", 1)
+            success, message = self.encode_targets(images, targets, **encode_args)
+        failed_hardware = attempted_hardware - {target["codec"] for target in targets}
+        if success and failed_hardware:
+            # A later encoder finished the same frames, so the failure was the device, not the input.
+            mark_hardware_encoders_failed(failed_hardware)
+            log_node_warning(self.NODE_LOG_PREFIX, f"Skipping {', '.join(sorted(failed_hardware))} until ComfyUI restarts.")
+        return success, message
+
+    def encode_targets(self, images, targets, fps, audio, audio_bitrate, frame_transport, ffmpeg_verbose, segments, segment_workers,
+                       metrics=NULL_METRICS, progress=None, deduplicate_frames=False, buffer_frames=DEFAULT_CHUNK_FRAMES,
+                       sequence_format="png", sequence_workers=0):
+        """One encode attempt of `targets`, single-process or segmented. Returns (success, message)."""
+        if segments > 1:
+            if deduplicate_frames:
+                log_node_warning(self.NODE_LOG_PREFIX, "deduplicate_frames is not applied to segmented encodes.")
+            return self.encode_video_segmented(images, targets, fps, audio, audio_bitrate, ffmpeg_verbose, segments, segment_workers,
+                                               metrics=metrics, progress=progress, buffer_frames=buffer_frames)
+
+        kept_indices, hold_args = None, []
+        if deduplicate_frames:
+            with metrics.span("deduplicate"):
+                kept_indices, hold_args = self.plan_held_frames(images, fps, len(targets), buffer_frames)
+        if deduplicate_frames:
+            metrics.set("frames_deduplicated", 0 if kept_indices is None else images.shape[0] - len(kept_indices))
+
         with tempfile.TemporaryDirectory() as temp_dir:
-            frame_paths = []
-            for i, image_tensor in enumerate(images):
+            raw_frame_stream = None
+            if frame_transport == "rawvideo_pipe":
                 try:
-                    img_pil = self.tensor_to_pil(image_tensor)
-                    frame_filename = os.path.join(temp_dir, f"frame_{i:06d}.png")
-                    img_pil.save(frame_filename, "PNG")
-                    frame_paths.append(frame_filename)
-                except Exception as e_frame:
-                    log_node_error(self.NODE_LOG_PREFIX, f"Error processing frame {i}: {e_frame}")
-                    return {"ui": {"text": [f"Error processing frame {i}: {e_frame}"]}}
-            if not frame_paths:
-                log_node_error(self.NODE_LOG_PREFIX, "Error: No frames were processed to save.")
-                return {"ui": {"text": ["Error: No frames were processed to save."]}}
-
-            if save_metadata == "enabled" and images.shape[0] > 0:
-                png_file_path = self.save_metadata_to_png(images[0], prompt, extra_pnginfo, output_path, png_filename.replace(".png", ""))
-                if png_file_path and show_preview:
-                    preview_files_for_ui.append({
-                        "filename": png_filename,
-                        "subfolder": self.get_subfolder_path(png_file_path, self.output_dir),
-                        "type": self.type
-                    })
-
-            ffmpeg_cmd = [self.ffmpeg_executable_path, '-y', '-framerate', str(fps), '-i', os.path.join(temp_dir, 'frame_%06d.png')]
-            has_audio_input = False
-
-            if audio is not None and isinstance(audio, dict) and "waveform" in audio and "sample_rate" in audio:
-                waveform_tensor = audio["waveform"]
-                sample_rate = audio["sample_rate"]
-                log_node_debug(self.NODE_LOG_PREFIX, f"Audio data. Waveform: {waveform_tensor.shape}, SR: {sample_rate}")
-                if waveform_tensor.ndim == 3 and waveform_tensor.shape[0] > 0 and waveform_tensor.shape[2] > 0:
-                    if waveform_tensor.shape[0] > 1:
-                        log_node_warning(self.NODE_LOG_PREFIX, f"Audio batch size {waveform_tensor.shape[0]}. Using first track.")
-                    waveform_to_save = waveform_tensor[0].cpu()
-                    if waveform_to_save.numel() > 0:
-                        try:
-                            temp_audio_file_for_ffmpeg = os.path.join(temp_dir, "temp_audio_for_ffmpeg.wav")
-                            torchaudio.save(temp_audio_file_for_ffmpeg, waveform_to_save, sample_rate)
-                            ffmpeg_cmd.extend(['-i', temp_audio_file_for_ffmpeg])
-                            has_audio_input = True
-                            log_node_info(self.NODE_LOG_PREFIX, f"Audio input prepared: {temp_audio_file_for_ffmpeg}")
-                        except Exception as e_asave:
-                            log_node_error(self.NODE_LOG_PREFIX, f"Error saving temp audio: {e_asave}. Skipping audio.")
-                            if temp_audio_file_for_ffmpeg and os.path.exists(temp_audio_file_for_ffmpeg):
-                                os.remove(temp_audio_file_for_ffmpeg)
-                            temp_audio_file_for_ffmpeg = None
-                            has_audio_input = False
-                    else:
-                        log_node_warning(self.NODE_LOG_PREFIX, "Audio waveform empty. Skipping audio.")
-                else:
-                    log_node_warning(self.NODE_LOG_PREFIX, f"Audio waveform shape {waveform_tensor.shape} unexpected. Skipping.")
-            elif audio is not None:
-                log_node_warning(self.NODE_LOG_PREFIX, f"Audio input not expected format. Type: {type(audio)}. Skipping.")
-
-            ffmpeg_cmd.extend(['-c:v', codec, '-pix_fmt', pixel_format])
-            if codec in ["libx264", "libx265"]:
-                ffmpeg_cmd.extend(['-crf', '19'])
-            if codec in ["libsvtav1"]:
-                ffmpeg_cmd.extend(['-crf', '35'])
-            if output_format in ["mp4", "mov"]:
-                ffmpeg_cmd.extend(['-movflags', '+faststart'])
-
-            if has_audio_input:
-                if audio_codec == "copy":
-                    ffmpeg_cmd.extend(['-c:a', 'copy'])
-                else:
-                    ffmpeg_cmd.extend(['-c:a', audio_codec])
-                    if audio_codec in ["aac", "mp3", "libopus"]:
-                        ffmpeg_cmd.extend(['-b:a', audio_bitrate])
-                ffmpeg_cmd.extend(['-shortest'])
+                    ffmpeg_input_args = self.build_raw_input_args(images, fps)
+                except ValueError as e_input:
+                    log_node_error(self.NODE_LOG_PREFIX, f"Error: {e_input}")
+                    return False, f"Error: {e_input}"
+                raw_frame_stream = metrics.wrap_frames(self.iter_raw_frames(images, buffer_frames, kept_indices))
             else:
-                ffmpeg_cmd.extend(['-an'])
-            ffmpeg_cmd.append(video_full_path)
+                try:
+                    with metrics.span("frame_serialization"):
+                        frame_paths = self.write_png_sequence(images, temp_dir, indices=kept_indices, chunk_size=buffer_frames,
+                                                              sequence_format=sequence_format, workers=sequence_workers)
+                except Exception as e_frame:
+                    log_node_error(self.NODE_LOG_PREFIX, str(e_frame))
+                    return False, str(e_frame)
+                if not frame_paths:
+                    log_node_error(self.NODE_LOG_PREFIX, "Error: No frames were processed to save.")
+                    return False, "Error: No frames were processed to save."
+                ffmpeg_input_args = ['-framerate', str(fps), '-i', os.path.join(temp_dir, f"frame_%06d{os.path.splitext(frame_paths[0])[1]}")]
+
+            audio_tracks, sample_rate = self.prepare_audio_tracks(audio)
+            audio_input_args, audio_feeders = self.build_audio_inputs(audio_tracks, sample_rate, temp_dir)
+            ffmpeg_cmd = [self.ffmpeg_executable_path, '-y', *ffmpeg_input_args, *audio_input_args]
+            for target in targets:
+                ffmpeg_cmd.extend(hold_args)
+                ffmpeg_cmd.extend(self.build_output_args(target, len(audio_tracks), audio_bitrate))
+                ffmpeg_cmd.append(target["path"])
+
+            with metrics.span("ffmpeg_encode"):
+                success, message = self.execute_ffmpeg(ffmpeg_cmd, raw_frame_stream, ffmpeg_verbose, audio_feeders, metrics,
+                                                       images.shape[0], progress.callback("encode") if progress else None)
+            if not success:
+                return False, message
+        for target in targets:
+            log_node_success(self.NODE_LOG_PREFIX, f"Video saved: {target['path']}")
+        return True, targets[0]["path"]
+
+    def encode_video_segmented(self, images, targets, fps, audio, audio_bitrate, ffmpeg_verbose, segments, segment_workers,
+                               metrics=NULL_METRICS, progress=None, buffer_frames=DEFAULT_CHUNK_FRAMES):
+        """Encodes GOP-aligned frame ranges in parallel ffmpeg processes, then joins each target with the concat
+        demuxer (stream copy) and muxes the audio once. Returns (success, message)."""
+        gop_size = segment_gop_size(fps)
+        segment_ranges = plan_segments(images.shape[0], segments, gop_size)
+        workers = resolve_worker_count(segment_workers, len(segment_ranges))
+        try:
+            raw_input_args = self.build_raw_input_args(images, fps)
+        except ValueError as e_input:
+            log_node_error(self.NODE_LOG_PREFIX, f"Error: {e_input}")
+            return False, f"Error: {e_input}"
+        log_node_info(self.NODE_LOG_PREFIX, f"Segmented encode: {len(segment_ranges)} segment(s) of up to "
+                      f"{segment_ranges[0][1] - segment_ranges[0][0]} frames (GOP {gop_size}) on {workers} worker(s).")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            segment_paths = [[os.path.join(temp_dir, f"target{t:02d}_segment_{n:04d}.{SEGMENT_CONTAINER}")
+                              for n in range(len(segment_ranges))] for t in range(len(targets))]
+
+            def encode_segment(segment_index):
+                start, end = segment_ranges[segment_index]
+                segment_cmd = [self.ffmpeg_executable_path, '-y', *raw_input_args]
+                for target_index, target in enumerate(targets):
+                    segment_cmd.extend(self.build_video_args(target))
+                    segment_cmd.extend(['-g', str(gop_size), '-an', segment_paths[target_index][segment_index]])
+                return self.execute_ffmpeg(segment_cmd, metrics.wrap_frames(self.iter_raw_frames(images[start:end], buffer_frames)),
+                                           ffmpeg_verbose, metrics=metrics, total_frames=end - start,
+                                           progress_callback=progress.callback(segment_index) if progress else None)
+
+            with metrics.span("ffmpeg_encode"), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aimms-segment") as pool:
+                results = list(pool.map(encode_segment, range(len(segment_ranges))))
+            for segment_index, (success, message) in enumerate(results):
+                if not success:
+                    log_node_error(self.NODE_LOG_PREFIX, f"Segment {segment_index} failed; aborting segmented encode.")
+                    return False, message
+
+            audio_tracks, sample_rate = self.prepare_audio_tracks(audio)
+            for target_index, target in enumerate(targets):
+                list_path = write_concat_list(os.path.join(temp_dir, f"target{target_index:02d}_segments.txt"), segment_paths[target_index],
+                                              [(end - start) / fps for start, end in segment_ranges])
+                with metrics.span("mux"):
+                    success, message = self.remux_target(['-f', 'concat', '-safe', '0', '-i', list_path], audio_tracks, sample_rate,
+                                                         target, audio_bitrate, ffmpeg_verbose, temp_dir, metrics)
+                if not success:
+                    return False, message
+        return True, targets[0]["path"]
 
-            log_node_info(self.NODE_LOG_PREFIX, f"Executing ffmpeg: {' '.join(ffmpeg_cmd)}")
+    def remux_target(self, video_input_args, audio_tracks, sample_rate, target, audio_bitrate, ffmpeg_verbose, temp_dir,
+                     metrics=NULL_METRICS):
+        """Stream-copies already encoded video into the target's container and muxes the optional audio."""
+        audio_input_args, audio_feeders = self.build_audio_inputs(audio_tracks, sample_rate, temp_dir)
+        remux_cmd = [self.ffmpeg_executable_path, '-y', *video_input_args, *audio_input_args,
+                     *self.build_stream_maps(len(audio_tracks), always=True), '-c:v', 'copy']
+        if target["output_format"] in ["mp4", "mov"]:
+            remux_cmd.extend(['-movflags', '+faststart'])
+        remux_cmd.extend(self.build_audio_args(len(audio_tracks), target["audio_codec"], audio_bitrate))
+        remux_cmd.append(target["path"])
+        success, message = self.execute_ffmpeg(remux_cmd, None, ffmpeg_verbose, audio_feeders, metrics)
+        if success:
+            log_node_success(self.NODE_LOG_PREFIX, f"Video saved: {target['path']}")
+        return success, message
+
+    def append_to_session(self, images, output_path, filename_prefix, fps, targets, save_metadata, overwrite_existing,
+                          show_preview, ffmpeg_verbose, audio, audio_bitrate, finalize_session, prompt, extra_pnginfo,
+                          metrics=NULL_METRICS, buffer_frames=DEFAULT_CHUNK_FRAMES, reset_session=False):
+        """Streams this window of frames into the session's live ffmpeg; on finalize, closes it and muxes the outputs.
+        With `reset_session`, an unfinished session for the same key is discarded first and a new one started.
+
+        Returns (ui_response, output_paths): the finished files on finalize, [] for an appended window, None on failure."""
+        key = session_key(output_path, filename_prefix)
+        if reset_session and discard_session(key):
+            log_node_warning(self.NODE_LOG_PREFIX, f"Discarded the unfinished session '{filename_prefix}'; starting a new video.")
+        session = acquire_session(key)
+        reaped = reaped_session(key) if session is None else None
+        if reaped is not None:
+            error_msg = (f"Error: session '{filename_prefix}' was discarded after sitting idle ({reaped[0]} frames in {reaped[1]} windows "
+                         f"lost). Enable reset_session to start a new video.")
+            log_node_error(self.NODE_LOG_PREFIX, error_msg)
+            return {"ui": {"text": [error_msg]}}, None
+        if session is None:
+            try:
+                raw_input_args = self.build_raw_input_args(images, fps)
+            except ValueError as e_input:
+                log_node_error(self.NODE_LOG_PREFIX, f"Error: {e_input}")
+                return {"ui": {"text": [f"Error: {e_input}"]}}, None
+            try:
+                video_filename, png_filename = self.plan_target_paths(output_path, filename_prefix, targets, save_metadata, overwrite_existing)
+            except OSError as e_reserve:
+                log_node_error(self.NODE_LOG_PREFIX, f"Error: could not reserve an output filename in {output_path}: {e_reserve}")
+                return {"ui": {"text": [f"Error: could not reserve an output filename in {output_path}: {e_reserve}"]}}, None
+            video_full_path = targets[0]["path"]
+
+            preview_files = []
+            if show_preview:
+                preview_files.append({"filename": video_filename, "subfolder": self.get_subfolder_path(video_full_path, self.output_dir), "type": self.type})
+            if save_metadata == "enabled":
+                with metrics.span("metadata_png"):
+                    png_file_path = self.save_metadata_to_png(self.first_frame(images), prompt, extra_pnginfo, output_path, png_filename.replace(".png", ""))
+                if png_file_path is None:
+                    release_filenames([os.path.join(output_path, png_filename)])
+                elif show_preview:
+                    preview_files.append({"filename": png_filename, "subfolder": self.get_subfolder_path(png_file_path, self.output_dir), "type": self.type})
+
+            temp_dir = tempfile.mkdtemp(prefix="aimms_session_")
+            intermediate_paths = [os.path.join(temp_dir, f"target{index:02d}.{SEGMENT_CONTAINER}") for index in range(len(targets))]
+            session_cmd = [self.ffmpeg_executable_path, '-y', *raw_input_args]
+            for target, intermediate_path in zip(targets, intermediate_paths):
+                session_cmd.extend(self.build_video_args(target))
+                session_cmd.extend(['-an', intermediate_path])
+            log_node_info(self.NODE_LOG_PREFIX, f"Starting video session for '{filename_prefix}': {' '.join(session_cmd)}")
             try:
-                process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8')
-                stdout, stderr = process.communicate(timeout=300)
-                if process.returncode != 0:
-                    err_msg = f"ffmpeg error (code {process.returncode}):\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
-                    log_node_error(self.NODE_LOG_PREFIX, err_msg)
-                    return {"ui": {"text": [f"ffmpeg error (code {process.returncode}): Check console for details."]}}
-                else:
-                    log_node_success(self.NODE_LOG_PREFIX, f"Video saved: {video_full_path}")
-                    # Only log stdout/stderr if verbosity is not set to quiet
-                    if ffmpeg_verbose != "quiet":
-                        if stdout.strip():
-                            log_node_info(self.NETag, f"ffmpeg stdout:\n{stdout}", msg_color_override="GREY")
-                        if stderr.strip():
-                            log_node_warning(self.NODE_LOG_PREFIX, f"ffmpeg stderr (warnings):\n{stderr}", msg_color_override="GREY")
-
-                    ui_response_content = {"images": preview_files_for_ui, "animated": (True,)}
-                    return {"ui": ui_response_content}
-            except subprocess.TimeoutExpired:
-                process.kill()
-                stdout, stderr = process.communicate()
-                log_node_error(self.NODE_LOG_PREFIX, f"ffmpeg timeout. STDOUT:{stdout} STDERR:{stderr}")
-                return {"ui": {"text": [f"ffmpeg timeout. STDOUT:{stdout} STDERR:{stderr}"]}}
+                ffmpeg_process = FFmpegProcess(session_cmd)
             except Exception as e:
+                os.rmdir(temp_dir)
+                release_filenames([target["path"] for target in targets])
                 log_node_error(self.NODE_LOG_PREFIX, f"Python error (ffmpeg exec): {str(e)}")
-                return {"ui": {"text": [f"Python error (ffmpeg exec): {str(e)}"]}}
-            finally:
-                if temp_audio_file_for_ffmpeg and os.path.exists(temp_audio_file_for_ffmpeg):
-                    try:
-                        os.remove(temp_audio_file_for_ffmpeg)
-                    except Exception as e_rem:
-                        log_node_warning(self.NODE_LOG_PREFIX, f"Warning: Could not remove temp audio: {e_rem}")
+                return {"ui": {"text": [f"Python error (ffmpeg exec): {str(e)}"]}}, None
+            session = VideoSession(key, ffmpeg_process, temp_dir, targets, intermediate_paths, tuple(images.shape[1:]), fps, preview_files)
+            register_session(session)
+        elif tuple(images.shape[1:]) != session.frame_shape or fps != session.fps:
+            release_session(session)
+            error_msg = (f"Error: session '{filename_prefix}' expects frames {session.frame_shape} at {session.fps} fps, "
+                         f"got {tuple(images.shape[1:])} at {fps} fps. Enable reset_session to start a new video.")
+            log_node_error(self.NODE_LOG_PREFIX, error_msg)
+            return {"ui": {"text": [error_msg]}}, None
+        else:
+            log_node_info(self.NODE_LOG_PREFIX, f"Continuing session '{filename_prefix}' after {session.frames_written} frames "
+                          f"in {session.windows} windows.")
+
+        try:
+            for chunk in metrics.wrap_frames(self.iter_raw_frames(images, buffer_frames)):
+                if not session.ffmpeg_process.write(chunk):
+                    raise RuntimeError("ffmpeg stopped accepting frames")
+        except Exception as e_write:
+            pop_session(key)
+            _, stderr = session.ffmpeg_process.kill()
+            session.discard()
+            log_node_error(self.NODE_LOG_PREFIX, f"Video session '{filename_prefix}' aborted: {e_write}\nSTDERR:\n{stderr}")
+            return {"ui": {"text": [f"Video session '{filename_prefix}' aborted: {e_write}"]}}, None
+        session.frames_written += images.shape[0]
+        session.windows += 1
+
+        if not finalize_session:
+            release_session(session)
+            message = f"Appended {images.shape[0]} frames to session '{filename_prefix}' ({session.frames_written} frames in {session.windows} windows)."
+            log_node_info(self.NODE_LOG_PREFIX, message)
+            return {"ui": {"text": [message]}}, []
+
+        pop_session(key)
+        try:
+            try:
+                session.ffmpeg_process.total_frames = session.frames_written
+                with metrics.span("ffmpeg_encode"):
+                    returncode, stdout, stderr = session.ffmpeg_process.finish()
+            except subprocess.TimeoutExpired as e_timeout:
+                log_node_error(self.NODE_LOG_PREFIX, f"ffmpeg timeout. STDOUT:{e_timeout.output} STDERR:{e_timeout.stderr}")
+                return {"ui": {"text": [f"ffmpeg timeout. STDOUT:{e_timeout.output} STDERR:{e_timeout.stderr}"]}}, None
+            if returncode != 0:
+                log_node_error(self.NODE_LOG_PREFIX, f"ffmpeg error (code {returncode}):\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}")
+                return {"ui": {"text": [f"ffmpeg error (code {returncode}): Check console for details."]}}, None
+            metrics.set("frames", session.frames_written)
+            log_node_info(self.NODE_LOG_PREFIX, f"Session '{filename_prefix}' closed after {session.frames_written} frames; muxing outputs.")
+            audio_tracks, sample_rate = self.prepare_audio_tracks(audio)
+            for target, intermediate_path in zip(session.targets, session.intermediate_paths):
+                with metrics.span("mux"):
+                    success, message = self.remux_target(['-i', intermediate_path], audio_tracks, sample_rate, target,
+                                                         audio_bitrate, ffmpeg_verbose, session.temp_dir, metrics)
+                if not success:
+                    return {"ui": {"text": [message]}}, None
+        finally:
+            session.discard()
+        return {"ui": {"images": session.preview_files, "animated": (True,)}}, [target["path"] for target in session.targets]
+
+    def execute_ffmpeg(self, ffmpeg_cmd, stdin_chunks, ffmpeg_verbose, pipe_feeders=(), metrics=NULL_METRICS,
+                       total_frames=None, progress_callback=None):
+        """Runs one ffmpeg command and logs its outcome. Returns (success, message).
+
+        `total_frames` (frames this run encodes) sizes the stall timeout; `progress_callback` gets each -progress block.
+        """
+        log_node_info(self.NODE_LOG_PREFIX, f"Executing ffmpeg: {' '.join(ffmpeg_cmd)}")
+        last_progress = {}
+
+        def on_progress(block):
+            last_progress.update(block)
+            if progress_callback is not None:
+                progress_callback(block)
+
+        metrics.add("ffmpeg_runs", 1)
+        try:
+            returncode, stdout, stderr = run_ffmpeg(ffmpeg_cmd, stdin_chunks=stdin_chunks, pipe_feeders=pipe_feeders,
+                                                    total_frames=total_frames, progress_callback=on_progress)
+            metrics.record_ffmpeg_progress(last_progress)
+            if returncode != 0:
+                err_msg = f"ffmpeg error (code {returncode}):\nSTDOUT:\n{stdout}\nSTDERR:\n{stderr}"
+                log_node_error(self.NODE_LOG_PREFIX, err_msg)
+                return False, f"ffmpeg error (code {returncode}): Check console for details."
+            # Only log stdout/stderr if verbosity is not set to quiet
+            if ffmpeg_verbose != "quiet":
+                if stdout.strip():
+                    log_node_info(self.NODE_LOG_PREFIX, f"ffmpeg stdout:\n{stdout}", msg_color_override="GREY")
+                if stderr.strip():
+                    log_node_warning(self.NODE_LOG_PREFIX, f"ffmpeg stderr (warnings):\n{stderr}", msg_color_override="GREY")
+            return True, ""
+        except subprocess.TimeoutExpired as e_timeout:
+            stdout, stderr = e_timeout.output, e_timeout.stderr
+            log_node_error(self.NODE_LOG_PREFIX, f"ffmpeg timeout. STDOUT:{stdout} STDERR:{stderr}")
+            return False, f"ffmpeg timeout. STDOUT:{stdout} STDERR:{stderr}"
+        except Exception as e:
+            log_node_error(self.NODE_LOG_PREFIX, f"Python error (ffmpeg exec): {str(e)}")
+            return False, f"Python error (ffmpeg exec): {str(e)}"
+
+    def finish_metrics(self, metrics, success, output_paths):
+        """Closes a run's metrics with the size of the files it produced."""
+        if metrics.enabled:
+            output_bytes = sum(os.path.getsize(path) for path in output_paths if os.path.exists(path))
+            metrics.finish(success, output_bytes=output_bytes)
+
+    def prepare_audio_tracks(self, audio):
+        """Returns ([interleaved float32 (samples, channels) array per batch entry], sample_rate), or ([], None)
+        when there is no usable audio. Each batch entry becomes its own audio track."""
+        if audio is not None and isinstance(audio, dict) and "waveform" in audio and "sample_rate" in audio:
+            waveform_tensor = audio["waveform"]
+            sample_rate = audio["sample_rate"]
+            log_node_debug(self.NODE_LOG_PREFIX, f"Audio data. Waveform: {waveform_tensor.shape}, SR: {sample_rate}")
+            if waveform_tensor.ndim == 3 and waveform_tensor.shape[0] > 0 and waveform_tensor.shape[2] > 0:
+                if waveform_tensor.shape[0] > 1:
+                    log_node_info(self.NODE_LOG_PREFIX, f"Audio batch size {waveform_tensor.shape[0]}. Muxing each entry as its own track.")
+                tracks = [waveform_tensor[index].detach().to(device="cpu", dtype=torch.float32).t().contiguous().numpy()
+                          for index in range(waveform_tensor.shape[0])]
+                return tracks, int(sample_rate)
+            elif waveform_tensor.ndim == 3 and waveform_tensor.shape[0] > 0:
+                log_node_warning(self.NODE_LOG_PREFIX, "Audio waveform empty. Skipping audio.")
+            else:
+                log_node_warning(self.NODE_LOG_PREFIX, f"Audio waveform shape {waveform_tensor.shape} unexpected. Skipping.")
+        elif audio is not None:
+            log_node_warning(self.NODE_LOG_PREFIX, f"Audio input not expected format. Type: {type(audio)}. Skipping.")
+        return [], None
+
+    def build_audio_inputs(self, audio_tracks, sample_rate, temp_dir):
+        """Returns (ffmpeg input args, PipeFeeders) that hand the tracks to ffmpeg as raw f32le PCM.
+
+        Tracks go through inherited pipes where the platform supports them, so muxing starts at once with no
+        intermediate file; elsewhere (Windows) they are written to raw PCM files in temp_dir.
+        """
+        input_args, feeders = [], []
+        for index, track in enumerate(audio_tracks):
+            if SUPPORTS_PIPE_INPUTS:
+                feeder = PipeFeeder(track)
+                feeders.append(feeder)
+                source = feeder.url
+            else:
+                source = os.path.join(temp_dir, f"audio_track_{index:02d}.f32le")
+                track.tofile(source)
+            input_args.extend(['-f', 'f32le', '-ar', str(sample_rate), '-ac', str(track.shape[1]), '-i', source])
+        return input_args, feeders
+
+    def build_raw_input_args(self, images, fps):
+        """Returns the ffmpeg input args for a (B, H, W, C) batch streamed as rawvideo on stdin."""
+        channels = images.shape[-1]
+        if channels not in self.RAW_PIXEL_FORMATS:
+            raise ValueError(f"Unsupported channel count {channels} for raw video (expected 1, 3 or 4).")
+        h, w = images.shape[1], images.shape[2]
+        return ['-f', 'rawvideo', '-pix_fmt', self.RAW_PIXEL_FORMATS[channels], '-s', f"{w}x{h}",
+                '-framerate', str(fps), '-i', 'pipe:0']
+
+    def build_video_args(self, target):
+        """Returns the ffmpeg video encoder options for one target, tuned by its performance profile."""
+        video_args = ['-c:v', target["codec"], '-pix_fmt', target["pixel_format"]]
+        video_args.extend(encoder_profile_args(target["codec"], target.get("profile", "balanced")))
+        return video_args
+
+    def build_stream_maps(self, audio_track_count, always=False):
+        """Maps the video (input 0) and every audio track input. Without audio the default selection is enough."""
+        if not audio_track_count and not always:
+            return []
+        stream_maps = ['-map', '0:v:0']
+        for input_index in range(1, audio_track_count + 1):
+            stream_maps.extend(['-map', f'{input_index}:a:0'])
+        return stream_maps
+
+    def build_audio_args(self, audio_track_count, audio_codec, audio_bitrate):
+        """Returns the ffmpeg audio options for one target ('-an' when there is no audio input)."""
+        if not audio_track_count:
+            return ['-an']
+        if audio_codec == "copy":
+            audio_args = ['-c:a', 'copy']
+        else:
+            audio_args = ['-c:a', audio_codec]
+            if audio_codec in ["aac", "mp3", "libopus"]:
+                audio_args.extend(['-b:a', audio_bitrate])
+        audio_args.extend(['-shortest'])
+        return audio_args
+
+    def build_output_args(self, target, audio_track_count, audio_bitrate):
+        """Returns the ffmpeg per-output options (everything before the output path) for one encode target."""
+        output_args = self.build_stream_maps(audio_track_count) + self.build_video_args(target)
+        if target["output_format"] in ["mp4", "mov"]:
+            output_args.extend(['-movflags', '+faststart'])
+        output_args.extend(self.build_audio_args(audio_track_count, target["audio_codec"], audio_bitrate))
+        return output_args
+
+    def resolve_encoders(self, targets, has_audio, prefer_hardware=False):
+        """Validates targets against the probed ffmpeg, switching to the fastest available encoder of the same
+        family when the requested one is missing. With prefer_hardware, the first usable hardware encoder replaces the
+        software one; the other hardware candidates and then the software encoder become the target's fallback_codecs.
+        Updates targets in place; returns an error message or None."""
+        capabilities = get_ffmpeg_capabilities()
+        if capabilities is None:
+            return None
+        for target in targets:
+            requested_codec = target["codec"]
+            if target["codec"] not in capabilities["encoders"]:
+                family = self.CODEC_FAMILIES.get(target["codec"], [target["codec"]])
+                available = [encoder for encoder in family if encoder in capabilities["encoders"]]
+                if not available:
+                    return f"Error: ffmpeg ({self.ffmpeg_executable_path}) has no encoder for {target['codec']} (tried {', '.join(family)})."
+                log_node_warning(self.NODE_LOG_PREFIX, f"{target['codec']} is not available in this ffmpeg; using {available[0]} instead.")
+                target["codec"] = available[0]
+            muxer = self.CONTAINER_MUXERS.get(target["output_format"], target["output_format"])
+            if muxer not in capabilities["muxers"]:
+                return f"Error: ffmpeg ({self.ffmpeg_executable_path}) cannot write {target['output_format']} files."
+            pixel_formats = get_encoder_pixel_formats(target["codec"])
+            if pixel_formats and target["pixel_format"] not in pixel_formats:
+                log_node_warning(self.NODE_LOG_PREFIX, f"{target['codec']} does not support {target['pixel_format']}; "
+                                 f"ffmpeg will pick the closest of: {', '.join(pixel_formats)}.")
+            if has_audio and target["audio_codec"] in self.AUDIO_ENCODERS:
+                if not any(encoder in capabilities["encoders"] for encoder in self.AUDIO_ENCODERS[target["audio_codec"]]):
+                    return f"Error: ffmpeg ({self.ffmpeg_executable_path}) has no {target['audio_codec']} audio encoder."
+            hardware_encoders = find_hardware_encoders(requested_codec, target["pixel_format"]) if prefer_hardware else []
+            if hardware_encoders:
+                target["fallback_codecs"] = hardware_encoders[1:] + [target["codec"]]
+                target["codec"] = hardware_encoders[0]
+                log_node_info(self.NODE_LOG_PREFIX, f"Using hardware encoder {target['codec']} (fallbacks: {', '.join(target['fallback_codecs'])}).")
+        return None
+
+    def plan_target_paths(self, output_path, filename_prefix, targets, save_metadata, overwrite_existing):
+        """Assigns a unique output path to every target. Returns the main (video_filename, png_filename)."""
+        video_filename, png_filename = self.get_unique_filename(output_path, filename_prefix, targets[0]["output_format"], save_metadata, overwrite_existing)
+        targets[0]["path"] = os.path.join(output_path, video_filename)
+        planned_names = {(filename_prefix, targets[0]["output_format"])}
+        for target in targets[1:]:
+            target["path"] = os.path.join(output_path, self.get_target_filename(
+                output_path, filename_prefix, target, planned_names, overwrite_existing))
+        if overwrite_existing:
+            # ffmpeg truncates in place; an output hardlinked into the encode cache must not take the entry with it.
+            for target in targets:
+                unshare_file(target["path"])
+        return video_filename, png_filename
+
+    def encode_cache_keys(self, digest, targets, fps, audio_bitrate, deduplicate_frames):
+        """Encode cache key of every target: the batch_digest of the frames and audio plus the settings that shape
+        its output, including the codec currently set on the target."""
+        return [encode_cache_key(digest, {"codec": target["codec"], "pixel_format": target["pixel_format"],
+                                          "output_format": target["output_format"], "audio_codec": target["audio_codec"],
+                                          "profile": target["profile"], "fps": fps, "audio_bitrate": audio_bitrate,
+                                          "deduplicate_frames": deduplicate_frames})
+                for target in targets]
+
+    def restore_cached_targets(self, cache_keys, targets):
+        """Places every target from the encode cache. Returns False, with no target left linked to the cache, unless
+        all of them were cached."""
+        cache = get_encode_cache()
+        if not all(cache.contains(key, target["output_format"]) for key, target in zip(cache_keys, targets)):
+            return False
+        restored = []
+        for key, target in zip(cache_keys, targets):
+            if not cache.fetch(key, target["output_format"], target["path"]):
+                for path in restored:
+                    unshare_file(path)
+                return False
+            restored.append(target["path"])
+        return True
+
+    def store_cached_targets(self, cache_keys, targets):
+        cache = get_encode_cache()
+        for key, target in zip(cache_keys, targets):
+            cache.store(key, target["output_format"], target["path"])
+
+    def parse_output_targets(self, additional_outputs, default_audio_codec):
+        """Parses the additional_outputs text into target dicts. Raises ValueError on an invalid line."""
+        targets = []
+        for line_number, line in enumerate((additional_outputs or "").splitlines(), start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) not in (3, 4):
+                raise ValueError(f"additional_outputs line {line_number} '{line}': expected codec,pixel_format,output_format[,audio_codec].")
+            codec, pixel_format, output_format = fields[:3]
+            audio_codec = fields[3] if len(fields) == 4 else default_audio_codec
+            for value, allowed, name in ((codec, self.VIDEO_CODECS, "codec"), (pixel_format, self.PIXEL_FORMATS, "pixel_format"),
+                                         (output_format, self.OUTPUT_FORMATS, "output_format"), (audio_codec, self.AUDIO_CODECS, "audio_codec")):
+                if value not in allowed:
+                    raise ValueError(f"additional_outputs line {line_number}: unknown {name} '{value}'. Choose from {', '.join(allowed)}.")
+            targets.append({"codec": codec, "pixel_format": pixel_format, "output_format": output_format, "audio_codec": audio_codec})
+        return targets
+
+    def get_target_filename(self, output_path, filename_prefix, target, planned_names, overwrite_existing):
+        """Names an additional output. Adds _codec (then _pixel_format) to the prefix when another output of this run
+        already uses the prefix with the same output_format. `planned_names` holds those (prefix, output_format) pairs."""
+        candidate_prefixes = [filename_prefix, f"{filename_prefix}_{target['codec']}",
+                              f"{filename_prefix}_{target['codec']}_{target['pixel_format']}"]
+        candidate_prefixes += [f"{candidate_prefixes[-1]}_{n}" for n in range(2, len(planned_names) + 2)]
+        candidate_prefix = next(prefix for prefix in candidate_prefixes if (prefix, target["output_format"]) not in planned_names)
+        planned_names.add((candidate_prefix, target["output_format"]))
+        video_filename, _ = self.get_unique_filename(output_path, candidate_prefix, target["output_format"], "disabled", overwrite_existing)
+        return video_filename
+
+    def plan_held_frames(self, images, fps, target_count, chunk_size=DEFAULT_CHUNK_FRAMES):
+        """Finds runs of identical frames, comparing `chunk_size` frames at a time. Returns (kept_indices, per-output
+        ffmpeg args) where the args re-time the kept frames to their original positions: setpts adds each collapsed
+        run's length to the frames after it, then the fps filter repeats each kept frame over the gap it left."""
+        max_runs = max(1, self.HOLD_FILTER_MAX_CHARS // (self.HOLD_FILTER_CHARS_PER_RUN * target_count))
+        kept_indices, runs = plan_frame_holds(find_held_frames(images, chunk_size), max_runs)
+        if not runs:
+            return None, []
+        shift = "".join(f"+{dropped}*gte(N,{sent_index})" for sent_index, dropped in runs)
+        log_node_info(self.NODE_LOG_PREFIX, f"Deduplicated {images.shape[0] - len(kept_indices)} held frames in {len(runs)} run(s); "
+                      f"sending {len(kept_indices)} of {images.shape[0]} frames.")
+        # Constant frame rate out: every container keeps the original duration and frame count, and the last frame its
+        # display time (variable-rate timestamps leave it without one, so the clip came out short or padded).
+        return kept_indices, ['-vf', f"setpts='(N{shift})/(FRAME_RATE*TB)',fps={fps}"]
+
+    def iter_frame_chunks(self, images, chunk_size=DEFAULT_CHUNK_FRAMES, indices=None):
+        """Yields (start_index, contiguous (n, H, W, C) uint8 chunk) for a (B, H, W, C) batch, or only its `indices`."""
+        return iter_uint8_chunks(images, chunk_size, indices)
+
+    def iter_raw_frames(self, images, chunk_size=DEFAULT_CHUNK_FRAMES, indices=None):
+        """Yields contiguous (n, H, W, C) uint8 chunks of a (B, H, W, C) batch for ffmpeg's rawvideo demuxer."""
+        start = 0
+        try:
+            for start, chunk in self.iter_frame_chunks(images, chunk_size, indices):
+                yield chunk
+        except Exception as e_frame:
+            raise RuntimeError(f"Error processing frames from {start}: {e_frame}") from e_frame
+
+    def write_png_sequence(self, images, temp_dir, indices=None, chunk_size=DEFAULT_CHUNK_FRAMES, sequence_format="png",
+                           workers=0):
+        """Writes the batch (or only its `indices`) as temp_dir/frame_%06d.<ext> for ffmpeg's image2 demuxer, numbered
+        in write order, in one of SEQUENCE_FORMATS. Returns the written paths in frame order.
+
+        Frames are encoded on a pool of `workers` threads (0 = CPU count); Pillow releases the GIL while it
+        compresses and writes. At most two chunks are in flight, so the next chunk converts while one is written.
+        """
+        extension, save_options, channel_counts = self.SEQUENCE_FORMATS[sequence_format]
+        if images.shape[-1] not in channel_counts:
+            log_node_warning(self.NODE_LOG_PREFIX, f"{sequence_format} can't hold {images.shape[-1]}-channel frames exactly; writing uncompressed PNG.")
+            extension, save_options, _ = self.SEQUENCE_FORMATS["png_uncompressed"]
+
+        def save_frame(index, frame_np):
+            frame_filename = os.path.join(temp_dir, f"frame_{index:06d}.{extension}")
+            try:
+                self.tensor_to_pil(frame_np).save(frame_filename, **save_options)
+            except Exception as e_frame:
+                raise RuntimeError(f"Error processing frame {index}: {e_frame}") from e_frame
+            return frame_filename
+
+        frame_paths, in_flight = [], []
+        next_index = 0
+        pool = ThreadPoolExecutor(max_workers=self.resolve_sequence_workers(workers, chunk_size), thread_name_prefix="aimms-sequence")
+        try:
+            for start, chunk in self.iter_frame_chunks(images, chunk_size, indices):
+                in_flight.append([pool.submit(save_frame, start + offset, frame_np) for offset, frame_np in enumerate(chunk)])
+                next_index = start + len(chunk)
+                if len(in_flight) > 1:
+                    frame_paths.extend(future.result() for future in in_flight.pop(0))
+            for futures in in_flight:
+                frame_paths.extend(future.result() for future in futures)
+        except RuntimeError:
+            raise
+        except Exception as e_frame:
+            raise RuntimeError(f"Error processing frame {next_index}: {e_frame}") from e_frame
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        return frame_paths
+
+    def resolve_sequence_workers(self, requested_workers, chunk_size):
+        """Threads for write_png_sequence: `requested_workers` (0 = CPU count), at most one per frame of the two
+        chunks in flight."""
+        frames_in_flight = 2 * max(1, int(chunk_size))
+        workers = requested_workers if requested_workers and requested_workers > 0 else (os.cpu_count() or 1)
+        return max(1, min(workers, frames_in_flight))
+
+    def first_frame(self, images):
+        """The first (H, W, C) frame of a batch or FrameStream, e.g. for the metadata PNG."""
+        return images.first_frame if isinstance(images, FrameStream) else images[0]
 
     def tensor_to_pil(self, tensor_image):
+        from PIL import Image  # Only the metadata PNG and png_sequence paths need Pillow; keeps it off package import.
         if isinstance(tensor_image, Image.Image):
             return tensor_image
+        image_np = self.tensor_to_uint8(tensor_image)
+        if image_np.shape[-1] == 1:
+            image_np = image_np.squeeze(-1)
+        return Image.fromarray(image_np)
+
+    def tensor_to_uint8(self, tensor_image):
+        """Converts a single HWC/CHW/HW frame (Tensor or NumPy) to an HWC uint8 array."""
         if isinstance(tensor_image, np.ndarray):
             if tensor_image.dtype != np.uint8:
                 tensor_image = np.clip(tensor_image, 0.0, 1.0)
                 tensor_image = (tensor_image * 255).astype(np.uint8)
-            if tensor_image.ndim == 3 and tensor_image.shape[-1] == 1:
-                tensor_image = tensor_image.squeeze(-1)
-            return Image.fromarray(tensor_image)
+            if tensor_image.ndim == 2:
+                tensor_image = tensor_image[..., np.newaxis]
+            return tensor_image
         if not isinstance(tensor_image, torch.Tensor):
             raise TypeError(f"Input must be Tensor, PIL, or NumPy, got {type(tensor_image)}")
         if tensor_image.ndim == 2:
@@ -254,10 +912,7 @@ class SaveFramesToVideoFFmpeg:
         image_np = tensor_image.cpu().float().numpy()
         if image_np.max() > 1.001 or image_np.min() < -0.001:
             image_np = np.clip(image_np, 0.0, 1.0)
-        image_np = (image_np * 255).astype(np.uint8)
-        if image_np.shape[-1] == 1:
-            image_np = image_np.squeeze(-1)
-        return Image.fromarray(image_np)
+        return (image_np * 255).astype(np.uint8)
 
 NODE_CLASS_MAPPINGS = {"SaveFramesToVideoFFmpeg": SaveFramesToVideoFFmpeg}
 NODE_DISPLAY_NAME_MAPPINGS = {"SaveFramesToVideoFFmpeg": "AIMMS - Save Images As Video (FFmpeg)"}
@@ -0,0 +1,45 @@
+# segmented_encode.py
+import math
+import os
+
+# Keyframe interval used for segmented encodes; segment boundaries are placed on multiples of it.
+SEGMENT_GOP_SECONDS = 2.0
+
+# Intermediate container for segments: carries every supported codec and keeps exact frame timestamps.
+SEGMENT_CONTAINER = "nut"
+
+
+def segment_gop_size(fps):
+    """Frames per GOP for a segmented encode at `fps`."""
+    return max(1, int(round(fps * SEGMENT_GOP_SECONDS)))
+
+
+def plan_segments(frame_count, segments, gop_size):
+    """Splits frame_count into at most `segments` (start, end) ranges whose boundaries fall on GOP multiples."""
+    if frame_count <= 0:
+        return []
+    segments = max(1, min(int(segments), math.ceil(frame_count / gop_size)))
+    frames_per_segment = math.ceil(math.ceil(frame_count / segments) / gop_size) * gop_size
+    return [(start, min(start + frames_per_segment, frame_count)) for start in range(0, frame_count, frames_per_segment)]
+
+
+def resolve_worker_count(requested_workers, segment_count):
+    """0 means one worker per segment, capped at the CPU count."""
+    if requested_workers and requested_workers > 0:
+        return max(1, min(requested_workers, segment_count))
+    return max(1, min(segment_count, os.cpu_count() or 1))
+
+
+def write_concat_list(list_path, segment_paths, segment_durations=None):
+    """Writes an ffmpeg concat demuxer list (use with -f concat -safe 0).
+
+    Explicit per-segment durations (seconds) keep the joined timeline exact instead of trusting each
+    segment's container-reported duration, which encoder delay can skew.
+    """
+    with open(list_path, "w", encoding="utf-8") as list_file:
+        for index, segment_path in enumerate(segment_paths):
+            escaped = segment_path.replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+            if segment_durations is not None:
+                list_file.write(f"duration {segment_durations[index]:.6f}\n")
+    return list_path
@@ -0,0 +1,153 @@
+# video_session.py
+import atexit
+import configparser
+import os
+import shutil
+import threading
+import time
+from .filename_index import release_filenames
+from .node_logger import log_node_warning
+
+SESSION_LOG_PREFIX = "VideoSession"
+
+# An unfinalized session nobody appended to for this long is treated as dead (e.g. its run was cancelled) and
+# discarded by the reaper. Generating the next window can take a while, so the default is generous; it can be
+# changed in the [APPEND_SESSIONS] section of ffmpeg_config.ini.
+DEFAULT_IDLE_TIMEOUT_HOURS = 6.0
+_REAP_INTERVAL_SECONDS = 60
+_PACKAGE_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+_SESSIONS = {}
+_REAPED_SESSIONS = {}  # key -> (frames_written, windows) of sessions the reaper discarded, until reset_session.
+_SESSIONS_LOCK = threading.Lock()
+_REAPER_STARTED = False
+_IDLE_TIMEOUT_SECONDS = None
+
+
+class VideoSession:
+    """One append-mode encode: a live ffmpeg process fed window by window until the session is finalized."""
+
+    def __init__(self, key, ffmpeg_process, temp_dir, targets, intermediate_paths, frame_shape, fps, preview_files):
+        self.key = key
+        self.ffmpeg_process = ffmpeg_process
+        self.temp_dir = temp_dir
+        self.targets = targets
+        self.intermediate_paths = intermediate_paths
+        self.frame_shape = frame_shape
+        self.fps = fps
+        self.preview_files = preview_files
+        self.frames_written = 0
+        self.windows = 0
+        self.last_used = time.monotonic()
+        self.in_use = True  # Set while a window is being appended; the reaper leaves such sessions alone.
+
+    def is_abandoned(self, now=None):
+        return not self.in_use and (now or time.monotonic()) - self.last_used > get_idle_timeout_seconds()
+
+    def discard(self):
+        """Kills the encoder and removes the intermediate files and any output placeholder that was never written."""
+        self.ffmpeg_process.kill()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        release_filenames([target["path"] for target in self.targets])
+
+
+def session_key(output_path, filename_prefix):
+    return (os.path.abspath(output_path), filename_prefix)
+
+
+def acquire_session(key):
+    """Returns the running session for `key`, marked in use until release_session, or None. However long the
+    session has been idle, it is continued; only the reaper discards sessions."""
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is not None:
+            session.in_use = True
+    return session
+
+
+def reaped_session(key):
+    """(frames_written, windows) of the session for `key` the reaper discarded, or None. Cleared by discard_session
+    and by registering a new session for the key."""
+    with _SESSIONS_LOCK:
+        return _REAPED_SESSIONS.get(key)
+
+
+def release_session(session):
+    """Marks the end of one appended window; the idle timeout counts from here."""
+    session.last_used = time.monotonic()
+    session.in_use = False
+
+
+def register_session(session):
+    with _SESSIONS_LOCK:
+        _SESSIONS[session.key] = session
+        _REAPED_SESSIONS.pop(session.key, None)
+    _start_reaper()
+
+
+def pop_session(key):
+    with _SESSIONS_LOCK:
+        return _SESSIONS.pop(key, None)
+
+
+def discard_session(key):
+    """Discards the running session for `key`, if any. Returns True if there was one (or the reaper discarded one)."""
+    session = pop_session(key)
+    with _SESSIONS_LOCK:
+        reaped = _REAPED_SESSIONS.pop(key, None) is not None
+    if session is None:
+        return reaped
+        return False
+    session.discard()
+    return True
+
+
+def get_idle_timeout_seconds():
+    """Idle time after which the reaper discards an unfinalized session, from ffmpeg_config.ini (read once)."""
+    global _IDLE_TIMEOUT_SECONDS
+    if _IDLE_TIMEOUT_SECONDS is None:
+        idle_timeout_hours = DEFAULT_IDLE_TIMEOUT_HOURS
+        config_file_path = os.path.join(_PACKAGE_DIRECTORY, "ffmpeg_config.ini")
+        if os.path.exists(config_file_path):
+            try:
+                config = configparser.ConfigParser(); config.read(config_file_path)
+                section = config['APPEND_SESSIONS'] if 'APPEND_SESSIONS' in config else {}
+                if section.get('idle_timeout_hours', '').strip():
+                    idle_timeout_hours = float(section['idle_timeout_hours'])
+            except (configparser.Error, ValueError) as e_cfg:
+                log_node_warning(SESSION_LOG_PREFIX, f"Error reading [APPEND_SESSIONS] from ffmpeg_config.ini: {e_cfg}. Using defaults.")
+        _IDLE_TIMEOUT_SECONDS = idle_timeout_hours * 3600
+    return _IDLE_TIMEOUT_SECONDS
+
+
+def _reap_abandoned_sessions():
+    while True:
+        time.sleep(_REAP_INTERVAL_SECONDS)
+        now = time.monotonic()
+        with _SESSIONS_LOCK:
+            abandoned = [_SESSIONS.pop(key) for key, session in list(_SESSIONS.items()) if session.is_abandoned(now)]
+            for session in abandoned:
+                _REAPED_SESSIONS[session.key] = (session.frames_written, session.windows)
+        for session in abandoned:
+            log_node_warning(SESSION_LOG_PREFIX, f"Discarding unfinalized session {session.key[1]!r} ({session.frames_written} frames "
+                             f"in {session.windows} windows): idle for over {get_idle_timeout_seconds() / 3600:g} hours.")
+            session.discard()
+
+
+def discard_all_sessions():
+    """Kills every running session's ffmpeg and removes its files, e.g. at interpreter exit."""
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    for session in sessions:
+        session.discard()
+
+
+def _start_reaper():
+    global _REAPER_STARTED
+    with _SESSIONS_LOCK:
+        if _REAPER_STARTED:
+            return
+        _REAPER_STARTED = True
+    threading.Thread(target=_reap_abandoned_sessions, name="aimms-session-reaper", daemon=True).start()
+    atexit.register(discard_all_sessions)